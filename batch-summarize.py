@@ -0,0 +1,177 @@
+# Headless batch processing of many URLs or local text files with one of the prompt presets
+#
+# Example:
+#   python batch-summarize.py urls.txt --preset "Student Notes" --language German --output results.jsonl
+#   cat urls.txt | python batch-summarize.py - --preset "Tweet Post" --concurrency 8 --rpm 120
+#
+# Results are appended to the output file as JSON lines while the batch runs. Running the same
+# command again after a crash skips every input that already has a successful result.
+#
+# For capacity planning, --trace-file appends the stage timings and token counts of every input
+# as JSON lines, and --metrics-file writes Prometheus counters and histograms when the batch ends.
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from content_loader import normalize_url
+from file_reader import SUPPORTED_FILE_TYPES, iter_path_text
+from models import AUTO_MODEL, model_catalog
+from pipeline import Job, ChunkingPolicy, run_job
+from prompts import default_prompts
+from rate_limiter import default_scheduler
+from tracing import Trace, default_metrics, write_jsonl
+
+# File types that can be processed from the local disk
+TEXT_FILE_EXTENSIONS = tuple(f".{file_type}" for file_type in SUPPORTED_FILE_TYPES)
+
+
+# Function to parse the command line
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a prompt preset over many URLs or text files.")
+    parser.add_argument("inputs", nargs="?", default="-",
+                        help="File with one URL or file path per line, '-' reads the list from stdin")
+    parser.add_argument("--preset", choices=list(default_prompts), default="Student Notes")
+    parser.add_argument("--language", default="German")
+    parser.add_argument("--model", choices=list(model_catalog) + [AUTO_MODEL], default="gpt-3.5-turbo",
+                        help=f"Model of the catalog, {AUTO_MODEL} picks the cheapest plan per input")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file that results are appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of inputs processed at the same time")
+    parser.add_argument("--chunk-workers", type=int, default=2, help="Parallel requests per input")
+    parser.add_argument("--rpm", type=float, default=60, help="Maximum LLM requests per minute for the whole batch")
+    parser.add_argument("--tpm", type=float, default=None, help="Maximum LLM tokens per minute for the whole batch")
+    parser.add_argument("--merge", action="store_true", help="Merge the chunk outputs of an input into one result")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="Send boilerplate and repeated chunks to the model as well")
+    parser.add_argument("--no-cache", action="store_true", help="Do not answer prompts from the response cache")
+    parser.add_argument("--trace-file", help="JSONL file that the trace of every input is appended to")
+    parser.add_argument("--metrics-file", help="File the Prometheus metrics of the batch are written to")
+    return parser.parse_args()
+
+
+# Function to read the list of inputs, skipping empty lines and comments
+def read_inputs(path):
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+# Function to build a stable id for an input, so the same URL is only processed once
+def input_id(item):
+    if item.startswith(("http://", "https://")):
+        return normalize_url(item)
+    return os.path.abspath(item)
+
+
+# Function to build the checkpoint key of an input, a run with another preset, language or model
+# processes the input again
+def checkpoint_key(item_id, preset, language, model):
+    return item_id, preset, language, model
+
+
+# Function to read the checkpoint keys that already have a successful result in the output file
+def read_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line may be cut off if the previous run crashed while writing
+                continue
+            if record.get("status") == "ok":
+                # With the Auto option, "model" is the model that was picked and "requested_model" the option
+                done.add(checkpoint_key(record["id"], record.get("preset"), record.get("language"),
+                                        record.get("requested_model", record.get("model"))))
+    return done
+
+
+# Function to read the text of a local file, block by block while its chunks are generated
+def load_file(item):
+    if not item.lower().endswith(TEXT_FILE_EXTENSIONS):
+        raise ValueError(f"Unsupported file type: {item}")
+    return iter_path_text(item)
+
+
+# Function to run the prompt over one input with the shared pipeline engine
+def process_item(item, args, trace=None):
+    is_url = item.startswith(("http://", "https://"))
+    chunking = ChunkingPolicy(merge_outputs=args.merge, strip_boilerplate=not args.keep_duplicates,
+                              drop_duplicates=not args.keep_duplicates)
+    job = Job(url=item if is_url else "", text=None if is_url else load_file(item), preset=args.preset,
+              language=args.language, model=args.model, chunking=chunking,
+              max_workers=args.chunk_workers, bypass_cache=args.no_cache)
+    return run_job(job, trace=trace)
+
+
+def main():
+    args = parse_args()
+
+    # All inputs share the scheduler's budget, cache hits do not count against it
+    for model in (list(model_catalog) if args.model == AUTO_MODEL else [args.model]):
+        default_scheduler.configure(model, requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+
+    done = read_checkpoint(args.output)
+    write_lock = threading.Lock()
+    # Only a limited number of inputs wait in the executor, so huge lists are never held in memory
+    pending = threading.BoundedSemaphore(args.concurrency * 2)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    with open(args.output, "a", encoding="utf-8") as output_file:
+        # Function to process one input and append its result to the output file
+        def run(item, item_id):
+            started = time.time()
+            record = {"id": item_id, "input": item, "preset": args.preset, "language": args.language,
+                      "model": args.model, "requested_model": args.model}
+            trace = Trace(job_id=item_id)
+            try:
+                result = process_item(item, args, trace)
+                record.update(status="ok", model=result.trace.attributes["model"], output=result.output,
+                              chunks=result.num_chunks,
+                              instruction_ratio=round(result.instruction_ratio, 4))
+            except Exception as exc:
+                record.update(status="error", error=str(exc))
+            record["seconds"] = round(time.time() - started, 3)
+
+            try:
+                with write_lock:
+                    output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output_file.flush()
+                    os.fsync(output_file.fileno())
+                    counts[record["status"]] += 1
+                    if args.trace_file:
+                        write_jsonl([trace], args.trace_file)
+            finally:
+                # Released even when writing failed, otherwise the producer would wait for this slot forever
+                pending.release()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for item in read_inputs(args.inputs):
+                item_id = input_id(item)
+                key = checkpoint_key(item_id, args.preset, args.language, args.model)
+                if key in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(key)
+                pending.acquire()
+                executor.submit(run, item, item_id)
+
+    if args.metrics_file:
+        default_metrics.write(args.metrics_file)
+
+    print(f"Done: {counts['ok']} ok, {counts['error']} failed, {counts['skipped']} skipped", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
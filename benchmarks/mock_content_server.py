@@ -0,0 +1,123 @@
+# Local HTTP server with generated blog pages and video transcripts for offline benchmarks
+#
+# Run on its own with: python -m benchmarks.mock_content_server --port 8002
+#
+# Pages are generated on request from their size in bytes:
+#   http://127.0.0.1:8002/blog/100000.html        blog post with paragraphs, navigation and a cookie banner
+#   http://127.0.0.1:8002/transcript/100000.html  auto-transcript style text with many repeated phrases
+import argparse
+import hashlib
+import random
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Words the fixture texts are made of
+WORDS = ("the video shows how a small team builds a product with simple tools and learns from every "
+         "release while users give feedback about speed price design quality and support").split()
+
+# Phrases that appear again and again in auto-generated transcripts
+TRANSCRIPT_FILLERS = ["so yeah", "you know", "like I said", "and basically", "let's go ahead and"]
+
+# Page parts that surround the article on real blogs
+BLOG_HEADER = "<nav><a href='/'>Home</a> <a href='/blog'>Blog</a> <a href='/about'>About</a></nav>"
+BLOG_FOOTER = ("<div class='cookie-banner'>We use cookies to improve your experience. Accept all cookies?</div>"
+               "<footer>Copyright 2024. All rights reserved.</footer>")
+
+
+# Function to generate one sentence from a seeded random generator
+def make_sentence(rng, fillers=None):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+    if fillers and rng.random() < 0.4:
+        words.insert(0, rng.choice(fillers))
+    return " ".join(words).capitalize() + "."
+
+
+# Function to generate the body text of a document with about the given size
+@lru_cache(maxsize=16)
+def make_text(kind, size):
+    rng = random.Random(f"{kind}-{size}")
+    paragraphs = []
+    length = 0
+    while length < size:
+        fillers = TRANSCRIPT_FILLERS if kind == "transcript" else None
+        paragraph = " ".join(make_sentence(rng, fillers) for _ in range(rng.randint(3, 8)))
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 9
+    return paragraphs
+
+
+# Function to render a fixture document as an HTML page
+@lru_cache(maxsize=16)
+def render_page(kind, size):
+    paragraphs = "".join(f"<p>{paragraph}</p>" for paragraph in make_text(kind, size))
+    title = f"Fixture {kind} with {size} bytes"
+    header = BLOG_HEADER if kind == "blog" else ""
+    footer = BLOG_FOOTER if kind == "blog" else ""
+    html = (f"<html><head><title>{title}</title></head><body>{header}"
+            f"<article><h1>{title}</h1>{paragraphs}</article>{footer}</body></html>")
+    return html.encode("utf-8")
+
+
+class MockContentHandler(BaseHTTPRequestHandler):
+    # Keep the benchmark output readable
+    def log_message(self, format, *args):
+        pass
+
+    # Parse /<kind>/<size>.html, returns None for unknown paths
+    def _page(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) != 2 or parts[0] not in ("blog", "transcript") or not parts[1].endswith(".html"):
+            return None
+        try:
+            size = int(parts[1][:-len(".html")])
+        except ValueError:
+            return None
+        return render_page(parts[0], size)
+
+    def _respond(self, send_body):
+        page = self._page()
+        if page is None:
+            self.send_error(404)
+            return
+        # The ETag lets the content loader revalidate without downloading the page again
+        etag = '"' + hashlib.sha256(page).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(page)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+
+# Function to start the content server in a background thread
+def start_mock_content_server(port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockContentHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve generated blog pages and transcripts.")
+    parser.add_argument("--port", type=int, default=8002)
+    args = parser.parse_args()
+
+    server = start_mock_content_server(args.port)
+    print(f"Mock content server on http://127.0.0.1:{server.server_port}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
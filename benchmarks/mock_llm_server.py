@@ -0,0 +1,154 @@
+# Local fake of the OpenAI chat completions API for offline benchmarks
+#
+# Run on its own:
+#   python -m benchmarks.mock_llm_server --port 8001 --latency 0.5 --tokens-per-second 80 --error-rate 0.05
+# and point the apps at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rough number of characters per token, the same estimate the chunker uses without tiktoken
+CHARS_PER_TOKEN = 4
+
+# Words the fake answers are made of
+ANSWER_WORDS = ["summary", "key", "point", "content", "video", "post", "idea", "note", "topic", "result"]
+
+
+class MockLLMStats:
+    # Counters of everything the server answered
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    # Add one answered request
+    def record(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    # Add one request that was answered with an error
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    # Return the counters and reset them
+    def snapshot(self, reset=False):
+        with self._lock:
+            values = {"calls": self.calls, "errors": self.errors, "prompt_tokens": self.prompt_tokens,
+                      "completion_tokens": self.completion_tokens}
+            if reset:
+                self.calls = self.errors = self.prompt_tokens = self.completion_tokens = 0
+        return values
+
+
+# Function to create the request handler class for one server configuration
+def make_handler(latency, tokens_per_second, error_rate, stats):
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Keep the benchmark output readable
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            # Fail some requests the same way the real API does when it is overloaded
+            if random.random() < error_rate:
+                stats.record_error()
+                if random.random() < 0.5:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                    {"Retry-After": "0.1"})
+                else:
+                    self._send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+                return
+
+            prompt_tokens = sum(len(message.get("content") or "") for message in body.get("messages", []))
+            prompt_tokens = max(1, prompt_tokens // CHARS_PER_TOKEN)
+            completion_tokens = max(1, min(body.get("max_tokens") or 300, 300))
+            words = [random.choice(ANSWER_WORDS) for _ in range(completion_tokens)]
+            stats.record(prompt_tokens, completion_tokens)
+
+            # Time to first token, then the answer at the configured throughput
+            time.sleep(latency)
+            if body.get("stream"):
+                self._send_stream(body.get("model"), words)
+            else:
+                time.sleep(completion_tokens / tokens_per_second)
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": " ".join(words)}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+        # Send a JSON response
+        def _send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        # Send the answer as server-sent events, one word per event
+        def _send_stream(self, model, words):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            for i, word in enumerate(words):
+                time.sleep(1 / tokens_per_second)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model,
+                         "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                      "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return MockLLMHandler
+
+
+# Function to start the fake API in a background thread, returns the server and its counters
+def start_mock_llm_server(port=0, latency=0.2, tokens_per_second=200.0, error_rate=0.0):
+    stats = MockLLMStats()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, tokens_per_second, error_rate, stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completions server.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/500")
+    args = parser.parse_args()
+
+    server, _ = start_mock_llm_server(args.port, args.latency, args.tokens_per_second, args.error_rate)
+    print(f"Mock LLM server on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,152 @@
+# Offline benchmark of the load -> split -> generate pipeline used by the Streamlit apps
+#
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks
+#   python -m benchmarks.run_benchmarks --sizes 1000 100000 --latency 0.5 --error-rate 0.05 --json results.json
+#
+# A fake OpenAI-compatible server and a fixture content server are started on localhost,
+# so no network access and no API key are needed. Blog pages and transcripts go through the
+# content loader, whose article parser keeps at most 100,000 characters. The "file" kind
+# stands for an uploaded text file and exercises chunking and generation at full size.
+import argparse
+import io
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+
+from benchmarks.mock_content_server import make_text, start_mock_content_server
+from benchmarks.mock_llm_server import start_mock_llm_server
+from content_loader import ContentLoader
+from file_reader import iter_file_text
+from llm_pool import get_llm
+from models import AUTO_MODEL, model_catalog
+from parallel_generation import DEFAULT_MAX_WORKERS
+from pipeline import Job, run_job
+from prompts import default_prompts
+from rate_limiter import RequestScheduler, ScheduledLLM
+
+# Document sizes in bytes, from a short post to a very long transcript
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000, 5_000_000]
+
+
+class TimedLLM:
+    # Wrap an LLM instance and record the latency of every call
+    def __init__(self, llm_instance):
+        self.llm_instance = llm_instance
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def generate_response(self, prompt, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.llm_instance.generate_response(prompt=prompt, **kwargs)
+        finally:
+            with self._lock:
+                self.latencies.append(time.perf_counter() - started)
+
+
+# Function to return the value below which the given share of the values lie
+def percentile(values, share):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(share * 100) - 1]
+
+
+# Function to run the pipeline for one document and collect its measurements
+def run_document(kind, size, args, llm_stats, content_port):
+    # Fresh loader and scheduler and no stored results, so no run profits from an earlier one
+    loader = ContentLoader()
+    scheduler = RequestScheduler(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)
+    llm_instance = TimedLLM(ScheduledLLM(get_llm(args.model, api_key="benchmark"), args.model, scheduler))
+    job = Job(url=f"http://127.0.0.1:{content_port}/{kind}/{size}.html", preset=args.preset, language="English",
+              model=args.model, max_workers=args.max_workers, use_cache=False)
+    llm_stats.snapshot(reset=True)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    if kind == "file":
+        # Same as load_file_content in the apps: the upload is decoded block by block while it is split
+        job.text = iter_file_text(io.BytesIO("\n\n".join(make_text(kind, size)).encode("utf-8")), "fixture.txt")
+    result = run_job(job, llm_instance=llm_instance, loader=loader)
+    finished = time.perf_counter()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    server = llm_stats.snapshot()
+    return {
+        "kind": kind,
+        "size": size,
+        "model": result.trace.attributes["model"],
+        "content_chars": result.content_chars,
+        "chunks": result.num_chunks,
+        "duplicate_chunks": result.duplicate_chunks,
+        "output_chars": len(result.output),
+        "wall_seconds": round(finished - started, 3),
+        "load_seconds": round(result.timings["load"], 3),
+        "chunk_seconds": round(result.timings["chunk"], 3),
+        "generate_seconds": round(result.timings["generate"], 3),
+        "calls": server["calls"],
+        "failed_calls": server["errors"],
+        "prompt_tokens": server["prompt_tokens"],
+        "instruction_ratio": round(result.instruction_ratio, 4),
+        "completion_tokens": server["completion_tokens"],
+        "p50_chunk_latency": round(percentile(llm_instance.latencies, 0.5), 3),
+        "p95_chunk_latency": round(percentile(llm_instance.latencies, 0.95), 3),
+        "peak_memory_mb": round(peak_memory / 2 ** 20, 1),
+    }
+
+
+# Function to print the results as a table
+def print_table(results):
+    columns = ["kind", "size", "content_chars", "chunks", "calls", "wall_seconds", "prompt_tokens",
+               "instruction_ratio", "completion_tokens", "p50_chunk_latency", "p95_chunk_latency", "peak_memory_mb"]
+    print("  ".join(f"{column:>17}" for column in columns))
+    for result in results:
+        print("  ".join(f"{str(result[column]):>17}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the summarization pipeline offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Document sizes in bytes")
+    parser.add_argument("--kinds", nargs="+", choices=["blog", "transcript", "file"],
+                        default=["blog", "transcript", "file"])
+    parser.add_argument("--model", choices=list(model_catalog) + [AUTO_MODEL], default="gpt-3.5-turbo")
+    parser.add_argument("--preset", choices=list(default_prompts), default="Student Notes")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds until the first token of the fake LLM")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Output speed of the fake LLM")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake LLM calls that fail")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    llm_server, llm_stats = start_mock_llm_server(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                                  error_rate=args.error_rate)
+    content_server = start_mock_content_server()
+    # The OpenAI SDK reads the base URL when the pooled client is created
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm_server.server_port}/v1"
+
+    # Import the article parser up front, so the first document is not charged for it
+    import SimplerLLM.tools.generic_loader  # noqa: F401
+
+    results = []
+    try:
+        for kind in args.kinds:
+            for size in args.sizes:
+                results.append(run_document(kind, size, args, llm_stats, content_server.server_port))
+    finally:
+        llm_server.shutdown()
+        content_server.shutdown()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# SQLite job broker of the multi-worker mode: the pages only enqueue jobs, job-worker.py processes run them
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, fields
+
+from job_queue import (CANCELLED, DONE, FAILED, FINAL_STATES, FINISHED_JOB_TTL, JOB_BROKER_PATH, QUEUED, RUNNING,
+                       JobCancelledError, JobRecord, RecordingHooks)
+from pipeline import ChunkingPolicy, Job, JobResult, run_job
+from result_store import shared_request_key
+from tracing import Trace, default_metrics
+
+# Location of the broker database when JOB_BROKER_PATH is not set, e.g. for a worker started by hand
+DEFAULT_BROKER_PATH = JOB_BROKER_PATH or ".job_broker.sqlite3"
+
+# Seconds between two progress writes of a running job, also how often it looks for a cancel request
+PROGRESS_INTERVAL = 0.5
+
+# Seconds an idle worker waits before it looks for a queued job again
+POLL_INTERVAL = 0.5
+
+# Running jobs whose worker has not written progress for this many seconds are given to another worker
+HEARTBEAT_TIMEOUT = 60
+
+# Times a job is started before it counts as failed, so a job that kills its worker does not kill them all
+MAX_ATTEMPTS = 2
+
+# Seconds to wait for a lock held by another process
+LOCK_TIMEOUT = 30
+
+# Shared broker instance, created on first use
+_default_broker = None
+_default_broker_lock = threading.Lock()
+
+
+# Function to turn a job into JSON, without its content and its API key: the content is stored on its own
+# and workers use the API key of their own environment, so no key of a user is ever written to the broker
+def serialize_job(job):
+    data = {job_field.name: getattr(job, job_field.name) for job_field in fields(job)
+            if job_field.name not in ("text", "api_key")}
+    data["chunking"] = asdict(job.chunking)
+    return json.dumps(data, ensure_ascii=False)
+
+
+# Function to rebuild a job from serialize_job
+def deserialize_job(data):
+    data = json.loads(data)
+    return Job(chunking=ChunkingPolicy(**data.pop("chunking")), **data)
+
+
+# Function to turn a job result into JSON, including its timings and trace
+def serialize_result(result):
+    data = {result_field.name: getattr(result, result_field.name) for result_field in fields(result)}
+    data["trace"] = result.trace.to_dict()
+    return json.dumps(data, ensure_ascii=False)
+
+
+# Function to rebuild a job result from serialize_result
+def deserialize_result(data):
+    data = json.loads(data)
+    return JobResult(trace=Trace.from_dict(data.pop("trace")), **data)
+
+
+class BrokerRecord:
+    # A job as stored in the broker, with the interface of JobRecord that the pages use;
+    # the job and the trace are only read when a page asks for them
+    def __init__(self, broker, row):
+        self.id = row["id"]
+        self.status = row["status"]
+        self.cancel_requested = bool(row["cancel_requested"])
+        self._broker = broker
+        self._row = row
+
+    @property
+    def job(self):
+        return deserialize_job(self._broker.read_field(self.id, "job"))
+
+    @property
+    def trace(self):
+        trace = self._broker.read_field(self.id, "trace")
+        return Trace.from_dict(json.loads(trace)) if trace else Trace(job_id=self.id)
+
+    # The fields a page shows, all read at the same time
+    def snapshot(self):
+        row = self._row
+        return {"id": self.id, "status": self.status, "stage": row["stage"], "num_chunks": row["num_chunks"],
+                "labels": json.loads(row["labels"]), "outputs": json.loads(row["outputs"]),
+                "calls_done": row["calls_done"],
+                "result": deserialize_result(row["result"]) if row["result"] else None, "error": row["error"],
+                "created_at": row["created_at"], "finished_at": row["finished_at"]}
+
+
+class Broker:
+    # Open (or create) the broker database, it can be shared by processes on one machine or a shared disk
+    def __init__(self, path=DEFAULT_BROKER_PATH, finished_job_ttl=FINISHED_JOB_TTL):
+        self.path = path
+        self.finished_job_ttl = finished_job_ttl
+        self._lock = threading.Lock()
+        # Transactions are opened explicitly, so claiming a job is one atomic step across processes
+        self._conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL lets the pages read progress while a worker writes, it cannot be switched on inside a transaction
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, request_key TEXT, status TEXT, job TEXT, stage TEXT, num_chunks INTEGER, "
+                "labels TEXT DEFAULT '[]', outputs TEXT DEFAULT '[]', calls_done INTEGER DEFAULT 0, result TEXT, "
+                "error TEXT, trace TEXT, cancel_requested INTEGER DEFAULT 0, subscribers INTEGER DEFAULT 1, "
+                "attempts INTEGER DEFAULT 0, worker TEXT, created_at REAL, heartbeat_at REAL, finished_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_request_key ON jobs (request_key)")
+            # Uploaded content, read once by the worker that claims the job and dropped when it ends
+            self._conn.execute("CREATE TABLE IF NOT EXISTS job_texts (id TEXT PRIMARY KEY, text TEXT)")
+
+    # Run statements in one write transaction
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # Queue a job and return its id, an identical URL job that is still queued or running is joined instead
+    def submit(self, job):
+        request_key = shared_request_key(job)
+        # A streamed upload is read into one string here, so another process can use it
+        text = job.text if job.text is None or isinstance(job.text, str) else "".join(job.text)
+        now = time.time()
+        with self._transaction():
+            self._expire(now)
+            if request_key is not None:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE request_key = ? AND status IN (?, ?) AND cancel_requested = 0",
+                    (request_key, QUEUED, RUNNING)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE jobs SET subscribers = subscribers + 1 WHERE id = ?", (row["id"],))
+                    return row["id"]
+            job_id = uuid.uuid4().hex
+            self._conn.execute("INSERT INTO jobs (id, request_key, status, job, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, request_key, QUEUED, serialize_job(job), now))
+            if text is not None:
+                self._conn.execute("INSERT INTO job_texts (id, text) VALUES (?, ?)", (job_id, text))
+        return job_id
+
+    # Return the record of a job, or None if the id is unknown or expired; only the status, progress and result
+    # are read, as pages ask for it every second
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, stage, num_chunks, labels, outputs, calls_done, result, error, cancel_requested, "
+                "created_at, finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return BrokerRecord(self, row) if row is not None else None
+
+    # Return one stored field of a job, e.g. its settings or its trace
+    def read_field(self, job_id, name):
+        if name not in ("job", "trace"):
+            raise ValueError(f"Unknown job field: {name}")
+        with self._lock:
+            row = self._conn.execute(f"SELECT {name} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    # Number of queued jobs that were submitted before the given one
+    def position(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < (SELECT created_at FROM jobs WHERE id = ?)",
+                (QUEUED, job_id)).fetchone()
+        return row[0]
+
+    # Cancel a job, with the same rules as JobQueue.cancel: False while other sessions still follow it
+    def cancel(self, job_id):
+        with self._transaction():
+            row = self._conn.execute("SELECT status, subscribers FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] in FINAL_STATES:
+                return True
+            if row["subscribers"] > 1:
+                self._conn.execute("UPDATE jobs SET subscribers = subscribers - 1 WHERE id = ?", (job_id,))
+                return False
+            # A queued job is cancelled right away, a running one by its worker at the next progress write
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1, subscribers = 0 WHERE id = ?", (job_id,))
+            if row["status"] == QUEUED:
+                self._conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                                   (CANCELLED, time.time(), job_id))
+                self._conn.execute("DELETE FROM job_texts WHERE id = ?", (job_id,))
+        return True
+
+    # Take the oldest queued job for a worker, returns (job id, job) or None when nothing is queued
+    def claim(self, worker_id):
+        now = time.time()
+        with self._transaction():
+            # Jobs of workers that stopped without finishing them are queued again, or fail after too many attempts
+            stale = now - HEARTBEAT_TIMEOUT
+            self._conn.execute("UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ? "
+                               "AND attempts < ?", (QUEUED, RUNNING, stale, MAX_ATTEMPTS))
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? "
+                               "AND heartbeat_at < ?", (FAILED, "The worker running the job stopped", now,
+                                                        RUNNING, stale))
+            row = self._conn.execute("SELECT id, job FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                     (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = ?, worker = ?, heartbeat_at = ?, attempts = attempts + 1, "
+                               "labels = '[]', outputs = '[]', calls_done = 0 WHERE id = ?",
+                               (RUNNING, worker_id, now, row["id"]))
+            text = self._conn.execute("SELECT text FROM job_texts WHERE id = ?", (row["id"],)).fetchone()
+        job = deserialize_job(row["job"])
+        job.text = text[0] if text is not None else None
+        return row["id"], job
+
+    # Write the progress of a job the worker runs, returns True when the job should be cancelled,
+    # also when it was given to another worker in the meantime
+    def update_progress(self, job_id, worker_id, state):
+        with self._transaction():
+            updated = self._conn.execute(
+                "UPDATE jobs SET stage = ?, num_chunks = ?, labels = ?, outputs = ?, calls_done = ?, heartbeat_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (state["stage"], state["num_chunks"], json.dumps(state["labels"], ensure_ascii=False),
+                 json.dumps(state["outputs"], ensure_ascii=False), state["calls_done"], time.time(), job_id,
+                 worker_id, RUNNING)).rowcount
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return not updated or row is None or bool(row["cancel_requested"])
+
+    # Move a job the worker runs to a final state, nothing is written when another worker has it now
+    def finish(self, job_id, worker_id, status, result=None, error=None, trace=None):
+        with self._transaction():
+            updated = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, result = ?, error = ?, trace = ?, finished_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (status, serialize_result(result) if result is not None else None, error,
+                 json.dumps(trace.to_dict(), ensure_ascii=False) if trace is not None else None,
+                 time.time(), job_id, worker_id, RUNNING)).rowcount
+            if updated:
+                self._conn.execute("DELETE FROM job_texts WHERE id = ?", (job_id,))
+
+    # Drop finished jobs that are too old and content that no job needs any more
+    def _expire(self, now):
+        self._conn.execute("DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+                           FINAL_STATES + (now - self.finished_job_ttl,))
+        # Content of jobs that failed because their worker stopped
+        self._conn.execute("DELETE FROM job_texts WHERE id NOT IN (SELECT id FROM jobs WHERE status IN (?, ?))",
+                           (QUEUED, RUNNING))
+
+
+# Function to run one claimed job, its progress is copied to the broker while it runs
+def process_job(broker, worker_id, job_id, job):
+    # The in-process record and hooks collect the progress, a thread writes it to the broker
+    record = JobRecord(job)
+    record.id = job_id
+    record.trace = Trace(job_id=job_id)
+    record.status = RUNNING
+    stopped = threading.Event()
+
+    # Function to write the progress until the job ends, and to pass on a cancel request. A failed write
+    # (e.g. the database stayed locked) is tried again at the next interval so the heartbeats go on
+    def report_progress():
+        while not stopped.wait(PROGRESS_INTERVAL):
+            try:
+                if broker.update_progress(job_id, worker_id, record.snapshot()):
+                    record.cancel_requested = True
+            except sqlite3.Error:
+                continue
+
+    reporter = threading.Thread(target=report_progress, daemon=True)
+    reporter.start()
+    try:
+        result = run_job(job, hooks=[RecordingHooks(record)], trace=record.trace)
+    except JobCancelledError:
+        status, result, error = CANCELLED, None, None
+    except Exception as exc:
+        status, result, error = FAILED, None, str(exc)
+    else:
+        status, error = DONE, None
+    finally:
+        stopped.set()
+        reporter.join()
+    broker.finish(job_id, worker_id, status, result=result, error=error, trace=record.trace)
+    return status
+
+
+# Function to pull and run jobs until stop is set, concurrency jobs at a time
+def run_worker(broker, concurrency=1, stop=None, metrics_file=None):
+    stop = stop or threading.Event()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    metrics_lock = threading.Lock()
+
+    # Function of one worker thread
+    def work():
+        while not stop.is_set():
+            claimed = broker.claim(worker_id)
+            if claimed is None:
+                stop.wait(POLL_INTERVAL)
+                continue
+            process_job(broker, worker_id, *claimed)
+            if metrics_file:
+                with metrics_lock:
+                    default_metrics.write(metrics_file)
+
+    threads = [threading.Thread(target=work, name=f"broker-worker-{i}") for i in range(max(concurrency, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# Function to get the broker shared by all sessions of this process
+def get_default_broker():
+    global _default_broker
+    with _default_broker_lock:
+        if _default_broker is None:
+            _default_broker = Broker()
+        return _default_broker
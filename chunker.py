@@ -0,0 +1,131 @@
+# Token-aware splitting of content into chunks that fit a model's context window
+import re
+
+try:
+    import tiktoken  # Exact token counts for OpenAI models
+except ImportError:  # Fall back to an estimate when tiktoken is not installed
+    tiktoken = None
+
+# Rough number of characters per token, used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+# Tokens kept free for the model's answer
+DEFAULT_RESPONSE_TOKENS = 1000
+
+# A segment is one sentence or line, including the whitespace that follows it
+_SEGMENT_PATTERN = re.compile(r".+?(?:[.!?]+(?=\s)|\n|$)\s*", re.S)
+
+# Characters a segment may grow to while waiting for its end in the next block, longer ones are passed on as they are
+MAX_CARRY_CHARS = 1 << 20
+
+# A word including the whitespace that follows it
+_WORD_PATTERN = re.compile(r"\S+\s*|\s+")
+
+# Cache of tokenizers, one per model name
+_encoders = {}
+
+
+# Function to get the tokenizer for a model
+def get_encoder(model_name):
+    if tiktoken is None:
+        return None
+    if model_name not in _encoders:
+        try:
+            _encoders[model_name] = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # Display names like "gpt-4 (8k context)" are not known to tiktoken
+            _encoders[model_name] = _load_fallback_encoder()
+        except Exception:
+            # tiktoken downloads its vocabulary on first use, which fails when offline
+            _encoders[model_name] = None
+    return _encoders[model_name]
+
+
+# Function to load the tokenizer used by current OpenAI chat models
+def _load_fallback_encoder():
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+# Function to count the tokens of a text for a model
+def count_tokens(text, model_name):
+    encoder = get_encoder(model_name)
+    if encoder is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+# Function to count the tokens a prompt template uses on its own, without any content
+def prompt_overhead_tokens(prompt_template, model_name):
+    return count_tokens(prompt_template.replace("{content}", ""), model_name)
+
+
+# Function to calculate the content token budget per chunk based on model and prompt
+def calculate_chunk_size(max_tokens, prompt_template, model_name, response_tokens=DEFAULT_RESPONSE_TOKENS):
+    budget = max_tokens - response_tokens - prompt_overhead_tokens(prompt_template, model_name)
+    return max(budget, 1)
+
+
+# Function to split a segment that does not fit into a single chunk
+def _split_oversized(segment, chunk_size, model_name):
+    # First try word boundaries, only cut inside a word if the word itself is too long
+    for match in _WORD_PATTERN.finditer(segment):
+        word = match.group()
+        if count_tokens(word, model_name) <= chunk_size:
+            yield word
+            continue
+        step = chunk_size * CHARS_PER_TOKEN
+        while count_tokens(word[:step], model_name) > chunk_size and step > 1:
+            step //= 2
+        for i in range(0, len(word), step):
+            yield word[i:i + step]
+
+
+# Function to cut text blocks into segments, the last segment of a block may continue in the next one
+def _iter_segments(blocks):
+    carry = ""
+    for block in blocks:
+        text = carry + block
+        carry = ""
+        for match in _SEGMENT_PATTERN.finditer(text):
+            if carry:
+                yield carry
+            carry = match.group()
+        if len(carry) > MAX_CARRY_CHARS:
+            yield carry
+            carry = ""
+    if carry:
+        yield carry
+
+
+# Function to split content into chunks of whole sentences, each at most chunk_size tokens
+def split_content(content, chunk_size, model_name):
+    return split_blocks([content], chunk_size, model_name)
+
+
+# Function to split a stream of text blocks into chunks, chunks are produced while the blocks are still read
+def split_blocks(blocks, chunk_size, model_name):
+    current = []
+    current_tokens = 0
+
+    for segment in _iter_segments(blocks):
+        segment_tokens = count_tokens(segment, model_name)
+
+        # Sentences longer than a whole chunk are split on word boundaries
+        pieces = [(segment, segment_tokens)]
+        if segment_tokens > chunk_size:
+            pieces = [(piece, count_tokens(piece, model_name))
+                      for piece in _split_oversized(segment, chunk_size, model_name)]
+
+        for piece, piece_tokens in pieces:
+            if current and current_tokens + piece_tokens > chunk_size:
+                yield "".join(current)
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens
+
+    if current:
+        yield "".join(current)
@@ -0,0 +1,213 @@
+# Cached loading of blog posts and YouTube transcripts, shared by all sessions of the process
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from tracing import annotate, span
+
+# Query parameters that only track where a link was shared and never change the content
+TRACKING_PARAMS = {"si", "feature", "fbclid", "gclid", "igshid", "mc_cid", "mc_eid", "ref_src", "pp"}
+
+# Host names that belong to YouTube
+YOUTUBE_HOSTS = {"youtube.com", "youtu.be", "youtube-nocookie.com"}
+
+# Subdomains of the mobile and music sites that show the same YouTube videos
+YOUTUBE_HOST_PREFIXES = ("m.", "music.")
+
+# Path prefixes that are followed by a YouTube video id
+YOUTUBE_ID_PATHS = ("/shorts/", "/embed/", "/live/", "/v/")
+
+# Maximum number of documents kept in memory
+DEFAULT_MAX_ENTRIES = 256
+
+# Seconds a cached blog post is used without asking the server whether it changed
+DEFAULT_FRESH_SECONDS = 300
+
+# Seconds after which a document without ETag/Last-Modified (e.g. a transcript) is loaded again
+DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+
+# Timeout for revalidation requests in seconds
+REVALIDATE_TIMEOUT = 10
+
+
+# Function to turn all variants of the same URL into one cache key
+def normalize_url(url):
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+
+    parts = urlsplit(url)
+    host = parts.hostname.lower() if parts.hostname else ""
+    if host.startswith("www."):
+        host = host[len("www."):]
+    for prefix in YOUTUBE_HOST_PREFIXES:
+        if host.startswith(prefix) and host[len(prefix):] in YOUTUBE_HOSTS:
+            host = host[len(prefix):]
+
+    # YouTube links collapse to the canonical watch URL of the video
+    if host in YOUTUBE_HOSTS:
+        video_id = None
+        if host == "youtu.be":
+            video_id = parts.path.strip("/").split("/")[0]
+        elif parts.path == "/watch":
+            video_id = dict(parse_qsl(parts.query)).get("v")
+        else:
+            for prefix in YOUTUBE_ID_PATHS:
+                if parts.path.startswith(prefix):
+                    video_id = parts.path[len(prefix):].split("/")[0]
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
+
+    # Other pages keep their path, but lose tracking parameters and the fragment
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    )
+    netloc = host if parts.port is None else f"{host}:{parts.port}"
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or "/", urlencode(query), ""))
+
+
+# Function to check if a normalized URL points to a YouTube video
+def is_youtube_url(normalized_url):
+    return normalized_url.startswith("https://www.youtube.com/watch?v=")
+
+
+# Function to read the ETag and Last-Modified headers of a page
+def fetch_validators(url):
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=REVALIDATE_TIMEOUT)
+    except requests.RequestException:
+        return {}
+    return {name: response.headers[name] for name in ("ETag", "Last-Modified") if name in response.headers}
+
+
+# Function to ask the server if a page changed since it was cached
+def is_unchanged(url, validators):
+    headers = {}
+    if "ETag" in validators:
+        headers["If-None-Match"] = validators["ETag"]
+    if "Last-Modified" in validators:
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+    try:
+        response = requests.head(url, headers=headers, allow_redirects=True, timeout=REVALIDATE_TIMEOUT)
+    except requests.RequestException:
+        # Keep serving the cached text when the server cannot be reached
+        return True
+    if response.status_code == 304:
+        return True
+    # Some servers ignore conditional HEAD requests but still send the same validators
+    return bool(validators) and all(response.headers.get(name) == value for name, value in validators.items())
+
+
+# Function to download a blog post and extract its text, the same way SimplerLLM's load_content does
+def load_article(url):
+    # Imported here so the first page paint does not wait for the newspaper/nltk import chain
+    import newspaper
+
+    article = newspaper.Article(url)
+    with span("fetch", source="article") as fetch:
+        article.download()
+        fetch.attributes["bytes"] = len(article.html or "")
+    if article.download_state != newspaper.article.ArticleDownloadState.SUCCESS:
+        raise ValueError(f"Unable to download {url}")
+    with span("extract") as extract:
+        article.parse()
+        extract.attributes["chars"] = len(article.text)
+    return article.text
+
+
+class ContentLoader:
+    # Create an empty in-memory content cache
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, fresh_seconds=DEFAULT_FRESH_SECONDS,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.fresh_seconds = fresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    # Return the extracted text of a URL, loading it only when needed
+    def load(self, url):
+        key = normalize_url(url)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["checked_at"] < self.fresh_seconds:
+                self._entries.move_to_end(key)
+                annotate(content_cache="hit")
+                return entry["text"]
+
+            # Concurrent requests for the same URL wait for the one fetch that is already running
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_owner:
+            annotate(content_cache="shared")
+            return future.result()
+
+        try:
+            text = self._fetch(url, key, entry, now)
+            future.set_result(text)
+            return text
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    # Revalidate a cached entry or download the content again
+    def _fetch(self, url, key, entry, now):
+        if entry is not None and now - entry["loaded_at"] < self.max_age_seconds:
+            if is_youtube_url(key):
+                unchanged = True
+            else:
+                with span("revalidate"):
+                    unchanged = bool(entry["validators"]) and is_unchanged(url, entry["validators"])
+            if unchanged:
+                annotate(content_cache="revalidated")
+                self._store(key, dict(entry, checked_at=now))
+                return entry["text"]
+
+        annotate(content_cache="miss")
+        if is_youtube_url(key):
+            # Imported here so the first page paint does not wait for the newspaper/nltk import chain
+            from SimplerLLM.tools.generic_loader import load_content
+
+            # The transcript API returns plain text, so there is no separate extraction step; the loader only
+            # understands watch and youtu.be links, so it gets the canonical watch URL of the key
+            with span("fetch", source="youtube"):
+                text = load_content(key).content
+            validators = {}
+        else:
+            text = load_article(url)
+            with span("validators"):
+                validators = fetch_validators(url)
+        self._store(key, {"text": text, "validators": validators, "loaded_at": now, "checked_at": now})
+        return text
+
+    # Add an entry and drop the least recently used ones above the limit
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Loader shared by all Streamlit sessions and scripts in this process
+default_loader = ContentLoader()
+
+
+# Function to load the text of a URL through the shared loader
+def load_url_content(url):
+    return default_loader.load(url)
@@ -0,0 +1,199 @@
+# Removal of web page boilerplate and of exact and near-duplicate chunks before they are sent to the model
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# Share of equal MinHash values above which two chunks count as near-duplicates
+DEFAULT_DUPLICATE_THRESHOLD = 0.85
+
+# Number of hash functions of a MinHash signature, split into LSH bands to find candidate pairs fast
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+# Number of consecutive words that form one shingle
+SHINGLE_WORDS = 5
+
+# Shingles hashed at once, bounds the temporary matrix to NUM_PERMUTATIONS x this many values
+SHINGLE_SLICE = 4096
+
+# Lines of at most this length that consist only of boilerplate phrases are removed
+MAX_BOILERPLATE_LINE = 120
+
+# Lines of at least this length are removed when they repeat a line seen before
+MIN_DUPLICATE_LINE = 40
+
+# Characters of text collected before a block without any line break is cleaned anyway
+MAX_BLOCK_CHARS = 1 << 20
+
+# Text that surrounds the article on many blogs, a line is only removed when nothing else is on it
+BOILERPLATE_PATTERN = re.compile(
+    r"we use cookies|(site|website) uses cookies|cookie (policy|settings|consent)|accept (all )?cookies|"
+    r"all rights reserved|privacy policy|terms of (use|service)|subscribe to (our|the|my) newsletter|"
+    r"share this (post|article)|follow us on|skip to (main )?content|related posts|leave a (comment|reply)",
+    re.I,
+)
+
+# Annotations of auto-generated YouTube transcripts
+TRANSCRIPT_ANNOTATION_PATTERN = re.compile(r"[ \t]*\[(music|applause|laughter|inaudible|foreign|__)\]", re.I)
+
+# A phrase of up to six words that is repeated right after itself on the same line ("you know you know"),
+# only collapsed in transcripts, where it is a stutter and not content
+REPEATED_PHRASE_PATTERN = re.compile(r"\b(\w+(?:[ \t]+\w+){0,5}?)(?:[ \t,]+\1\b)+", re.I)
+
+# Line that opens or closes a code block in Markdown
+CODE_FENCE_PATTERN = re.compile(r"\s*(```|~~~)")
+
+_WORD_PATTERN = re.compile(r"\w+")
+_LETTER_PATTERN = re.compile(r"[^\W\d_]")
+
+# Prime modulus and random coefficients of the hash functions, fixed so signatures are stable across runs
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, int(_PRIME), NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, int(_PRIME), NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+# Function to normalize a line or chunk for exact comparisons
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+# Function to check if a line is nothing but boilerplate phrases, separators, years and symbols
+def _is_boilerplate_line(normalized):
+    return (len(normalized) <= MAX_BOILERPLATE_LINE and BOILERPLATE_PATTERN.search(normalized) is not None
+            and not _LETTER_PATTERN.search(BOILERPLATE_PATTERN.sub("", normalized)))
+
+
+# Function to remove boilerplate lines from loaded web content, and annotations and stuttered phrases
+# from transcripts; lines inside code blocks are kept as they are, state carries an open code block
+# from one block of a stream to the next
+def strip_boilerplate(text, transcript=False, state=None):
+    state = state if state is not None else {}
+    if transcript:
+        text = TRANSCRIPT_ANNOTATION_PATTERN.sub("", text)
+        text = REPEATED_PHRASE_PATTERN.sub(r"\1", text)
+
+    kept = []
+    seen = set()
+    for line in text.split("\n"):
+        if CODE_FENCE_PATTERN.match(line):
+            state["in_code"] = not state.get("in_code", False)
+            kept.append(line)
+            continue
+        normalized = _normalize(line)
+        if not normalized or state.get("in_code"):
+            kept.append(line)
+            continue
+        if _is_boilerplate_line(normalized):
+            continue
+        if len(normalized) >= MIN_DUPLICATE_LINE and normalized in seen:
+            continue
+        seen.add(normalized)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+# Function to clean a stream of text blocks, every block is cut at its last line break so lines stay whole
+def strip_boilerplate_blocks(blocks, transcript=False):
+    state = {}
+    carry = ""
+    for block in blocks:
+        text = carry + block
+        cut = text.rfind("\n") + 1
+        if not cut and len(text) < MAX_BLOCK_CHARS:
+            carry = text
+            continue
+        if not cut:
+            cut = len(text)
+        carry = text[cut:]
+        yield strip_boilerplate(text[:cut], transcript, state)
+    if carry:
+        yield strip_boilerplate(carry, transcript, state)
+
+
+# Function to hash the word shingles of a text, returns the distinct hashes as a NumPy array
+def shingle_hashes(text):
+    # Words are hashed one by one as they are found, without a list of all words
+    word_hashes = np.fromiter((zlib.crc32(match.group().encode("utf-8"))
+                               for match in _WORD_PATTERN.finditer(text.lower())), dtype=np.uint64)
+    count = max(len(word_hashes) - SHINGLE_WORDS + 1, min(len(word_hashes), 1))
+    shingles = np.zeros(count, dtype=np.uint64)
+    # Rolling combination of the word hashes, overflow simply wraps around
+    for offset in range(min(SHINGLE_WORDS, len(word_hashes))):
+        shingles = shingles * np.uint64(1_000_003) + word_hashes[offset:offset + count]
+    return np.unique(shingles % _PRIME)
+
+
+# Function to calculate the MinHash signature of a text
+def minhash_signature(text):
+    shingles = shingle_hashes(text)
+    if not len(shingles):
+        return np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    # All hash functions applied to a slice of shingles at a time, a * x + b stays below 2**62
+    signature = np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    for start in range(0, len(shingles), SHINGLE_SLICE):
+        hashes = (np.outer(_A, shingles[start:start + SHINGLE_SLICE]) + _B[:, None]) % _PRIME
+        np.minimum(signature, hashes.min(axis=1), out=signature)
+    return signature
+
+
+class DuplicateFilter:
+    # Remember the chunks seen so far, so repeats can be recognized while chunks are still produced
+    def __init__(self, threshold=DEFAULT_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.duplicates = {}
+        self._count = 0
+        self._exact = {}
+        self._signatures = {}
+        self._buckets = defaultdict(list)
+
+    # Return the index of the earlier chunk that the next chunk repeats, or None if it is new
+    def check(self, chunk):
+        index = self._count
+        self._count += 1
+
+        key = hashlib.sha1(_normalize(chunk).encode("utf-8")).digest()
+        if key in self._exact:
+            self.duplicates[index] = self._exact[key]
+            return self._exact[key]
+        self._exact[key] = index
+
+        # Chunks that share all values of at least one band are candidates, only those are compared
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        signature = minhash_signature(chunk)
+        band_keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+        candidates = {candidate for band_key in band_keys for candidate in self._buckets[band_key]}
+        similarity = {candidate: np.mean(self._signatures[candidate] == signature) for candidate in candidates}
+        best = max(similarity, key=similarity.get, default=None)
+        if best is not None and similarity[best] >= self.threshold:
+            self.duplicates[index] = best
+            return best
+
+        self._signatures[index] = signature
+        for band_key in band_keys:
+            self._buckets[band_key].append(index)
+        return None
+
+    # Pass on the chunks that do not repeat an earlier one
+    def filter(self, chunks):
+        for chunk in chunks:
+            if self.check(chunk) is None:
+                yield chunk
+
+
+# Function to find duplicate chunks, returns {index of the duplicate: index of the chunk it repeats}
+def find_duplicates(chunks, threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    duplicate_filter = DuplicateFilter(threshold)
+    for chunk in chunks:
+        duplicate_filter.check(chunk)
+    return duplicate_filter.duplicates
+
+
+# Function to drop duplicate chunks, returns the remaining chunks and the number that was dropped
+def drop_duplicate_chunks(chunks, threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    duplicate_filter = DuplicateFilter(threshold)
+    unique_chunks = list(duplicate_filter.filter(chunks))
+    return unique_chunks, len(duplicate_filter.duplicates)
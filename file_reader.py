@@ -0,0 +1,63 @@
+# Incremental reading of uploaded and local files, text is produced block by block instead of all at once
+import codecs
+import os
+
+# Bytes read and decoded at a time
+BLOCK_SIZE = 1 << 20
+
+# File types that can be uploaded in the Streamlit pages or passed to the batch script
+SUPPORTED_FILE_TYPES = ["txt", "md", "pdf", "docx"]
+
+
+# Function to decode a binary file in blocks, invalid UTF-8 is replaced instead of stopping the job
+def iter_text_blocks(file, block_size=BLOCK_SIZE):
+    # utf-8-sig also drops the byte order mark that some editors write
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    while True:
+        data = file.read(block_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+# Function to extract the text of a PDF page by page
+def iter_pdf_text(file):
+    # Imported here so pages that never see a PDF do not load PyPDF2
+    from PyPDF2 import PdfReader
+
+    for page in PdfReader(file).pages:
+        text = page.extract_text() or ""
+        if text:
+            yield text + "\n\n"
+
+
+# Function to extract the text of a Word document paragraph by paragraph
+def iter_docx_text(file):
+    # Imported here so pages that never see a Word document do not load python-docx
+    import docx
+
+    for paragraph in docx.Document(file).paragraphs:
+        yield paragraph.text + "\n"
+
+
+# Function to read the text of a file object, the file type is taken from its name
+def iter_file_text(file, name):
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    if extension == "pdf":
+        return iter_pdf_text(file)
+    if extension == "docx":
+        return iter_docx_text(file)
+    if extension in SUPPORTED_FILE_TYPES:
+        return iter_text_blocks(file)
+    raise ValueError(f"Unsupported file type: {name}")
+
+
+# Function to read the text of a local file, the file is opened when the first block is needed
+def iter_path_text(path):
+    with open(path, "rb") as input_file:
+        yield from iter_file_text(input_file, path)
@@ -0,0 +1,51 @@
+# Worker process of the multi-worker mode: takes jobs that the pages queued in the broker and runs them
+#
+# Example:
+#   JOB_BROKER_PATH=/srv/summarizer/jobs.sqlite3 streamlit run ui5.py
+#   JOB_BROKER_PATH=/srv/summarizer/jobs.sqlite3 python job-worker.py --concurrency 2
+#
+# Start as many workers as the machine (or the API budget) allows, each one runs --concurrency jobs
+# at a time and the chunks of a job in parallel as before. The broker is a SQLite file, so workers
+# on other machines need it on a shared disk. Jobs run with the OPENAI_API_KEY of the worker's
+# environment, the keys of users are never written to the broker. The LLM_RPM and LLM_TPM budgets
+# apply per process, divide them by the number of workers to keep the total under the account limits.
+import argparse
+import signal
+import sys
+import threading
+
+from broker import DEFAULT_BROKER_PATH, Broker, run_worker
+from job_queue import MAX_CONCURRENT_JOBS
+
+
+# Function to parse the command line
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the jobs that the pages queue in the job broker.")
+    parser.add_argument("--broker", default=DEFAULT_BROKER_PATH,
+                        help="Broker database, the pages use the one in the JOB_BROKER_PATH environment variable")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_JOBS,
+                        help="Number of jobs this worker runs at the same time")
+    parser.add_argument("--metrics-file", help="File the Prometheus metrics of this worker are written to")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    broker = Broker(args.broker)
+    stop = threading.Event()
+
+    # Running jobs are finished before the worker exits, queued ones stay for the other workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    print(f"Worker waiting for jobs in {args.broker}", file=sys.stderr)
+    worker = threading.Thread(target=run_worker, args=(broker, args.concurrency, stop, args.metrics_file))
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(timeout=1)
+    except KeyboardInterrupt:
+        stop.set()
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# Background job queue: pipeline runs keep going across Streamlit reruns, reloads and disconnects
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import PipelineHooks, run_job
+from result_store import shared_request_key
+from tracing import Trace
+
+# Jobs that run at the same time in this process, more jobs wait in the queue
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 2))
+
+# SQLite file of the job broker, when set the pages only enqueue jobs and job-worker.py processes run them
+JOB_BROKER_PATH = os.environ.get("JOB_BROKER_PATH")
+
+# Finished jobs kept so a page can still reattach and show their output
+MAX_FINISHED_JOBS = 200
+
+# Seconds a finished job is kept after it ended
+FINISHED_JOB_TTL = 60 * 60
+
+# States a job goes through, the last three are final
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelledError(RuntimeError):
+    # Raised inside a running job after cancel() was called for it
+    pass
+
+
+class JobRecord:
+    # State and partial results of one submitted job
+    def __init__(self, job):
+        self.id = uuid.uuid4().hex
+        self.job = job
+        self.status = QUEUED
+        self.stage = None
+        self.num_chunks = None
+        # Labels and outputs of the calls of the current batch, e.g. one per task and chunk
+        self.labels = []
+        self.outputs = []
+        self.calls_done = 0
+        self.result = None
+        self.error = None
+        self.trace = Trace(job_id=self.id)
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+        # Sessions that submitted this job, identical requests share one record while it is not finished
+        self.request_key = None
+        self.subscribers = 1
+        self._lock = threading.Lock()
+
+    # Copy of the fields a page shows, taken under the lock so they fit together
+    def snapshot(self):
+        with self._lock:
+            return {"id": self.id, "status": self.status, "stage": self.stage, "num_chunks": self.num_chunks,
+                    "labels": list(self.labels), "outputs": list(self.outputs), "calls_done": self.calls_done,
+                    "result": self.result, "error": self.error, "created_at": self.created_at,
+                    "finished_at": self.finished_at}
+
+
+class RecordingHooks(PipelineHooks):
+    # Hooks that store the progress and the finished chunks of a job in its record
+    def __init__(self, record):
+        self.record = record
+
+    # Stop at the next stage or chunk once the job was cancelled
+    def _check_cancelled(self):
+        if self.record.cancel_requested:
+            raise JobCancelledError("The job was cancelled")
+
+    def on_stage_start(self, stage, job):
+        self._check_cancelled()
+        with self.record._lock:
+            self.record.stage = stage
+
+    def on_chunks(self, num_chunks, job):
+        with self.record._lock:
+            self.record.num_chunks = num_chunks
+
+    def on_batch(self, job):
+        with self.record._lock:
+            self.record.labels = []
+            self.record.outputs = []
+            self.record.calls_done = 0
+
+    # Calls that still wait for the rate limit are not sent any more once the job was cancelled
+    def on_call_start(self, job):
+        self._check_cancelled()
+
+    # Calls are announced one by one while the content is still read and split
+    def on_call(self, index, label, job):
+        self._check_cancelled()
+        with self.record._lock:
+            self.record.labels.append(label)
+            self.record.outputs.append("")
+
+    def on_stream_event(self, event, index, text, job):
+        self._check_cancelled()
+        with self.record._lock:
+            if event == "delta":
+                self.record.outputs[index] += text
+            elif event == "restart":
+                self.record.outputs[index] = ""
+
+    def on_chunk_done(self, index, text, job):
+        with self.record._lock:
+            self.record.outputs[index] = text
+            self.record.calls_done += 1
+        self._check_cancelled()
+
+
+class JobQueue:
+    # Create a queue whose jobs run on a fixed number of worker threads
+    def __init__(self, max_concurrent_jobs=MAX_CONCURRENT_JOBS, max_finished_jobs=MAX_FINISHED_JOBS,
+                 finished_job_ttl=FINISHED_JOB_TTL):
+        self.max_finished_jobs = max_finished_jobs
+        self.finished_job_ttl = finished_job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix="pipeline-job")
+        self._records = OrderedDict()
+        # Unfinished records by the request they run, so identical requests wait for the same job
+        self._active = {}
+        self._lock = threading.Lock()
+
+    # Queue a job and return its id, an identical URL job that is still queued or running is joined instead
+    def submit(self, job):
+        request_key = shared_request_key(job)
+        with self._lock:
+            self._expire()
+            active = self._records.get(self._active.get(request_key))
+            if active is not None and active.status not in FINAL_STATES and not active.cancel_requested:
+                active.subscribers += 1
+                return active.id
+            record = JobRecord(job)
+            record.request_key = request_key
+            self._records[record.id] = record
+            if request_key is not None:
+                self._active[request_key] = record.id
+        record.future = self._executor.submit(self._run, record)
+        return record.id
+
+    # Return the record of a job, or None if the id is unknown or expired
+    def get(self, job_id):
+        with self._lock:
+            return self._records.get(job_id)
+
+    # Number of queued jobs that were submitted before the given one
+    def position(self, job_id):
+        with self._lock:
+            position = 0
+            for record in self._records.values():
+                if record.id == job_id:
+                    return position
+                if record.status == QUEUED:
+                    position += 1
+        return None
+
+    # Cancel a job: a queued job never starts, a running one stops after its current chunk requests;
+    # a job that several sessions joined keeps running until all of them cancelled it, then False is returned
+    def cancel(self, job_id):
+        record = self.get(job_id)
+        if record is None or record.status in FINAL_STATES:
+            return True
+        with self._lock:
+            record.subscribers -= 1
+            if record.subscribers > 0:
+                return False
+        record.cancel_requested = True
+        if record.future is not None and record.future.cancel():
+            self._finish(record, CANCELLED)
+        return True
+
+    # Run a job on a worker thread and store its outcome
+    def _run(self, record):
+        if record.cancel_requested:
+            self._finish(record, CANCELLED)
+            return
+        with record._lock:
+            record.status = RUNNING
+        try:
+            result = run_job(record.job, hooks=[RecordingHooks(record)], trace=record.trace)
+        except JobCancelledError:
+            self._finish(record, CANCELLED)
+        except Exception as exc:
+            self._finish(record, FAILED, error=str(exc))
+        else:
+            self._finish(record, DONE, result=result)
+
+    # Move a job to a final state
+    def _finish(self, record, status, result=None, error=None):
+        with self._lock:
+            if self._active.get(record.request_key) == record.id:
+                del self._active[record.request_key]
+        with record._lock:
+            record.status = status
+            record.result = result
+            record.error = error
+            record.stage = None
+            record.finished_at = time.time()
+            # The content and the key are not needed any more, only the outputs are kept
+            record.job.text = None
+            record.job.api_key = None
+
+    # Drop finished jobs that are too old or above the limit, the oldest first
+    def _expire(self):
+        now = time.time()
+        finished = [record for record in self._records.values() if record.status in FINAL_STATES]
+        for i, record in enumerate(finished):
+            if len(finished) - i > self.max_finished_jobs or now - record.finished_at > self.finished_job_ttl:
+                del self._records[record.id]
+
+
+# Queue shared by all Streamlit sessions of this process
+default_queue = JobQueue()
+
+
+# Function to get the queue the pages submit to: the broker of the worker processes when JOB_BROKER_PATH is set,
+# otherwise the queue of this process
+def get_default_queue():
+    if JOB_BROKER_PATH:
+        # Imported here because the broker builds on the records and hooks of this module
+        from broker import get_default_broker
+
+        return get_default_broker()
+    return default_queue
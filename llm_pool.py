@@ -0,0 +1,109 @@
+# Pool of LLM clients that are created once and reused across chunks, reruns and sessions
+import threading
+import time
+from collections import OrderedDict
+
+from models import api_model_name
+from rate_limiter import hash_api_key
+from streaming import DEFAULT_SYSTEM_PROMPT, DEFAULT_MAX_TOKENS
+from tracing import annotate
+
+# Connections kept open per API key, enough for every parallel chunk request
+MAX_CONNECTIONS = 32
+
+# Seconds to wait for an answer before the request counts as failed
+REQUEST_TIMEOUT = 120.0
+
+# API keys whose clients are kept, the least recently used key is dropped beyond this
+MAX_POOLED_KEYS = 64
+
+# Seconds a key may go unused before its client and LLM instances are dropped
+IDLE_SECONDS = 15 * 60
+
+# Clients and LLM instances per hashed API key, in the order they were last used
+_pool = OrderedDict()
+_lock = threading.Lock()
+
+
+class _PoolEntry:
+    # The client and the LLM instances of one API key
+    def __init__(self):
+        self.client = None
+        self.llm_instances = {}
+        self.last_used = time.monotonic()
+
+
+class OpenAIChatLLM:
+    # Chat model with the same generate_response interface as SimplerLLM, bound to one API key
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model_name = model_name
+
+    # Generate a response, errors are raised so the scheduler can retry them
+    def generate_response(self, prompt, system_prompt=DEFAULT_SYSTEM_PROMPT, max_tokens=DEFAULT_MAX_TOKENS,
+                          temperature=0.7, top_p=1.0):
+        completion = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+        )
+        if completion.usage is not None:
+            annotate(prompt_tokens=completion.usage.prompt_tokens, completion_tokens=completion.usage.completion_tokens)
+        return completion.choices[0].message.content
+
+
+# Function to get the pool entry of an API key and drop keys that were idle for too long or are beyond the limit,
+# must be called with the lock held; dropped clients close their connections once running calls let go of them
+def _pool_entry(api_key):
+    now = time.monotonic()
+    key_hash = hash_api_key(api_key)
+    entry = _pool.pop(key_hash, None) or _PoolEntry()
+    entry.last_used = now
+    _pool[key_hash] = entry
+    while len(_pool) > MAX_POOLED_KEYS or now - next(iter(_pool.values())).last_used > IDLE_SECONDS:
+        _pool.popitem(last=False)
+    return entry
+
+
+# Function to get the OpenAI client for an API key, with keep-alive connections
+def get_openai_client(api_key=None):
+    with _lock:
+        entry = _pool_entry(api_key)
+        if entry.client is None:
+            # Imported here so the first page paint does not wait for the OpenAI SDK
+            import httpx
+            from openai import OpenAI
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+                timeout=REQUEST_TIMEOUT,
+            )
+            # Retries are done by the shared scheduler, not by the SDK
+            entry.client = OpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+        return entry.client
+
+
+# Function to get the LLM instance for a provider, model and API key
+def get_llm(model_name, api_key=None, provider="openai"):
+    key = (provider, model_name)
+    with _lock:
+        llm_instance = _pool_entry(api_key).llm_instances.get(key)
+    if llm_instance is not None:
+        return llm_instance
+
+    if provider == "openai":
+        # Each key gets its own client, so sessions with different keys never share credentials
+        llm_instance = OpenAIChatLLM(get_openai_client(api_key), api_model_name(model_name))
+    else:
+        # Other providers go through SimplerLLM, which reads its keys from the environment
+        from SimplerLLM.language.llm import LLM, LLMProvider
+
+        llm_instance = LLM.create(provider=LLMProvider[provider.upper()], model_name=model_name)
+
+    with _lock:
+        return _pool_entry(api_key).llm_instances.setdefault(key, llm_instance)
@@ -0,0 +1,130 @@
+# Map-reduce summarization: run the task on every chunk, then merge the partial results tree-wise
+from chunker import calculate_chunk_size, count_tokens, split_content
+from parallel_generation import generate_for_chunks, DEFAULT_MAX_WORKERS
+
+# Prompt used to merge several partial results into one
+REDUCE_PROMPT = """You are given partial results that were created by running the same task on consecutive parts of one document.
+Merge them into one single result that fulfils the task exactly once, in the format and language the task asks for.
+Remove repetitions and keep the most important points from all parts.
+Task: {task}
+Partial results:
+{content}"""
+
+# Prompt used to condense content once into notes that several tasks are then run on
+CONDENSE_PROMPT = """Condense the following text into detailed notes in its original language.
+Keep every key point, fact, number, name, example and quote that a summary, social media post or study notes could use.
+Leave out repetitions, filler and anything unrelated to the main content.
+Text:
+{content}"""
+
+# Separator between partial results inside one reduce prompt
+PARTIAL_SEPARATOR = "\n\n---\n\n"
+
+# Expected size of one partial result, SimplerLLM limits responses to 300 tokens by default
+ESTIMATED_PARTIAL_TOKENS = 300
+
+
+# Function to turn the user's prompt template into a task description for the reduce prompt
+def build_reduce_prompt(prompt_template):
+    task = prompt_template.replace("{content}", "the Content").strip()
+    return REDUCE_PROMPT.replace("{task}", task)
+
+
+# Function to group consecutive partial results so every group fits into one reduce prompt,
+# a partial that does not fit on its own is split and each piece becomes a group
+def group_partials(partials, budget, model_name):
+    separator_tokens = count_tokens(PARTIAL_SEPARATOR, model_name)
+    groups = []
+    current = []
+    current_tokens = 0
+
+    for partial in partials:
+        partial_tokens = count_tokens(partial, model_name) + separator_tokens
+        if current and current_tokens + partial_tokens > budget:
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        if partial_tokens > budget:
+            groups.extend([piece] for piece in split_content(partial, max(budget - separator_tokens, 1), model_name))
+            continue
+        current.append(partial)
+        current_tokens += partial_tokens
+
+    if current:
+        groups.append(current)
+    return groups
+
+
+# Function to run one level of the merge tree, returns the partial results of the next level
+def merge_level(llm_instance, prompt_template, partials, budget, model_name, max_workers=DEFAULT_MAX_WORKERS):
+    groups = group_partials(partials, budget, model_name)
+    # A partial that fits but has no neighbour to merge with is carried to the next level as it is;
+    # when no group merges anything, every partial is shortened on its own so the next level can pair them,
+    # unless they are already no longer than an answer and could not get shorter
+    carry = any(len(group) > 1 for group in groups)
+    if not carry and all(count_tokens(partial, model_name) <= ESTIMATED_PARTIAL_TOKENS for partial in partials):
+        return partials
+    merged = iter(generate_for_chunks(llm_instance, prompt_template,
+                                      [PARTIAL_SEPARATOR.join(group) for group in groups
+                                       if not carry or len(group) > 1],
+                                      max_workers=max_workers))
+    return [group[0] if carry and len(group) == 1 else next(merged) for group in groups]
+
+
+# Function to check if a level of the merge tree made progress, i.e. left fewer or shorter partial results
+def _made_progress(before, after, model_name):
+    return len(after) < len(before) or (count_tokens(PARTIAL_SEPARATOR.join(after), model_name)
+                                        < count_tokens(PARTIAL_SEPARATOR.join(before), model_name))
+
+
+# Function to calculate the number of reduce calls on every level that is needed for a number of partial results
+def plan_reduce_levels(num_partials, max_tokens, prompt_template, model_name, partial_tokens=ESTIMATED_PARTIAL_TOKENS):
+    budget = calculate_chunk_size(max_tokens, build_reduce_prompt(prompt_template), model_name)
+    # Larger context windows merge more partials per call and need fewer levels
+    fan_in = max(2, budget // max(partial_tokens, 1))
+    levels = []
+    while num_partials > 1:
+        num_partials = -(-num_partials // fan_in)
+        levels.append(num_partials)
+    return levels
+
+
+# Function to calculate how many reduce levels are needed for a number of partial results
+def plan_reduce_depth(num_partials, max_tokens, prompt_template, model_name, partial_tokens=ESTIMATED_PARTIAL_TOKENS):
+    return len(plan_reduce_levels(num_partials, max_tokens, prompt_template, model_name, partial_tokens))
+
+
+# Function to run the prompt on all chunks and merge the results into one output
+def map_reduce(llm_instance, prompt_template, chunks, model_name, max_tokens, max_workers=DEFAULT_MAX_WORKERS):
+    # Map: run the task on every chunk in parallel
+    partials = generate_for_chunks(llm_instance, prompt_template, chunks, max_workers=max_workers)
+    return reduce_partials(llm_instance, prompt_template, partials, model_name, max_tokens, max_workers=max_workers)
+
+
+# Function to merge partial results tree-wise until one result is left
+def reduce_partials(llm_instance, prompt_template, partials, model_name, max_tokens, max_workers=DEFAULT_MAX_WORKERS):
+    # Reduce: merge groups of partial results in parallel until one result is left
+    reduce_prompt = build_reduce_prompt(prompt_template)
+    budget = calculate_chunk_size(max_tokens, reduce_prompt, model_name)
+    while len(partials) > 1:
+        merged = merge_level(llm_instance, reduce_prompt, partials, budget, model_name, max_workers=max_workers)
+        # Partials that cannot be merged into one prompt nor get shorter are given back together
+        if not _made_progress(partials, merged, model_name):
+            return PARTIAL_SEPARATOR.join(merged)
+        partials = merged
+
+    return partials[0] if partials else ""
+
+
+# Function to condense chunks into notes that fit into one chunk of content_budget tokens
+def condense_chunks(llm_instance, chunks, model_name, content_budget, max_tokens, max_workers=DEFAULT_MAX_WORKERS,
+                    on_done=None):
+    partials = generate_for_chunks(llm_instance, CONDENSE_PROMPT, chunks, max_workers=max_workers, on_done=on_done)
+    # Notes that are still too long together are condensed again, group by group
+    budget = calculate_chunk_size(max_tokens, CONDENSE_PROMPT, model_name)
+    while len(partials) > 1 and count_tokens(PARTIAL_SEPARATOR.join(partials), model_name) > content_budget:
+        merged = merge_level(llm_instance, CONDENSE_PROMPT, partials, budget, model_name, max_workers=max_workers)
+        if not _made_progress(partials, merged, model_name):
+            break
+        partials = merged
+    return PARTIAL_SEPARATOR.join(partials)
@@ -0,0 +1,72 @@
+# Automatic model choice: estimate calls, time and cost of a job for every catalog model and pick the best plan
+from dataclasses import dataclass
+
+from chunker import calculate_chunk_size, count_tokens, prompt_overhead_tokens
+from map_reduce import CONDENSE_PROMPT, ESTIMATED_PARTIAL_TOKENS, plan_reduce_levels
+from models import model_catalog
+from streaming import DEFAULT_MAX_TOKENS
+
+
+@dataclass
+class ModelPlan:
+    model: str
+    # Content tokens per chunk and number of chunks the content is split into
+    chunk_size: int
+    chunks: int
+    # LLM calls of all stages, and the prompt and completion tokens they are expected to use
+    calls: int
+    input_tokens: int
+    output_tokens: int
+    # Estimated US dollars and seconds of the whole job
+    cost: float
+    seconds: float
+
+
+# Function to count the tokens of content that is given as one string or as text blocks
+def count_content_tokens(content, model_name):
+    blocks = [content] if isinstance(content, str) else content
+    return sum(count_tokens(block, model_name) for block in blocks)
+
+
+# Function to estimate how a job would run on one model of the catalog
+def plan_model(job, spec, content_tokens):
+    tasks = job.task_templates
+    context_tokens = job.chunking.context_tokens or spec.context_tokens
+    overhead = {name: prompt_overhead_tokens(template, spec.name) for name, template in tasks.items()}
+    chunk_size = min(calculate_chunk_size(context_tokens, template, spec.name,
+                                          response_tokens=job.chunking.response_tokens)
+                     for template in tasks.values())
+    chunks = max(-(-content_tokens // chunk_size), 1)
+
+    # Batches of calls that run one after another, as (number of calls, prompt tokens, completion tokens)
+    batches = []
+    task_chunks, task_content_tokens = chunks, content_tokens
+    if job.chunking.shared_summary and len(tasks) > 1 and chunks > 1:
+        condense_overhead = prompt_overhead_tokens(CONDENSE_PROMPT, spec.name)
+        batches.append((chunks, content_tokens + chunks * condense_overhead, chunks * DEFAULT_MAX_TOKENS))
+        task_chunks, task_content_tokens = 1, chunks * DEFAULT_MAX_TOKENS
+    batches.append((task_chunks * len(tasks), task_content_tokens * len(tasks) + task_chunks * sum(overhead.values()),
+                    task_chunks * len(tasks) * DEFAULT_MAX_TOKENS))
+    if job.chunking.merge_outputs and task_chunks > 1:
+        # The merge trees of the tasks run side by side, level by level
+        for level_calls in plan_reduce_levels(task_chunks, context_tokens, job.prompt_template, spec.name):
+            calls = level_calls * len(tasks)
+            batches.append((calls, task_chunks * len(tasks) * ESTIMATED_PARTIAL_TOKENS + calls * max(overhead.values()),
+                            calls * DEFAULT_MAX_TOKENS))
+            task_chunks = level_calls
+
+    # Calls of a batch run max_workers at a time, each one waits for its first token and then for its answer
+    call_seconds = spec.first_token_seconds + DEFAULT_MAX_TOKENS / spec.output_tokens_per_second
+    seconds = sum(-(-calls // max(job.max_workers, 1)) * call_seconds for calls, _, _ in batches)
+    input_tokens = sum(tokens for _, tokens, _ in batches)
+    output_tokens = sum(tokens for _, _, tokens in batches)
+    return ModelPlan(model=spec.name, chunk_size=chunk_size, chunks=chunks, calls=sum(calls for calls, _, _ in batches),
+                     input_tokens=input_tokens, output_tokens=output_tokens,
+                     cost=spec.cost(input_tokens, output_tokens), seconds=seconds)
+
+
+# Function to plan a job on every model the Auto option may pick, the best plan first:
+# the lowest cost, then the shortest time, then the fewest calls
+def plan_models(job, content_tokens):
+    plans = [plan_model(job, spec, content_tokens) for spec in model_catalog.values() if spec.auto]
+    return sorted(plans, key=lambda plan: (round(plan.cost, 4), round(plan.seconds, 1), plan.calls))
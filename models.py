@@ -0,0 +1,61 @@
+# Catalog of the models that can be selected in the apps and the batch script
+import json
+import os
+from dataclasses import dataclass
+
+# JSON file with a list of model entries that replaces the built-in catalog, e.g. to add models or update prices
+MODEL_CATALOG_PATH = os.environ.get("MODEL_CATALOG_PATH")
+
+# Option that lets the planner pick the model from the catalog by the size of the content
+AUTO_MODEL = "Auto"
+
+
+@dataclass
+class ModelSpec:
+    # Name shown in the apps, also used for the response cache, the scheduler budgets and the traces
+    name: str
+    # Model name sent to the API
+    api_name: str
+    context_tokens: int
+    # US dollars per million prompt and completion tokens
+    input_price: float
+    output_price: float
+    # Rough speed, only used to estimate how long a job takes
+    first_token_seconds: float = 0.5
+    output_tokens_per_second: float = 60.0
+    # Whether the Auto option may pick this model
+    auto: bool = True
+
+    # Estimated price in US dollars of a number of prompt and completion tokens
+    def cost(self, input_tokens, output_tokens):
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000
+
+
+# Built-in catalog, the first three entries are the models the apps offered from the start
+DEFAULT_MODELS = [
+    ModelSpec("gpt-3.5-turbo", "gpt-3.5-turbo", 4096, 0.50, 1.50, 0.4, 80.0),
+    ModelSpec("gpt-4 (8k context)", "gpt-4", 8192, 30.00, 60.00, 0.8, 25.0),
+    ModelSpec("gpt-4 (32k context)", "gpt-4-32k", 32768, 60.00, 120.00, 1.0, 20.0),
+    ModelSpec("gpt-4o-mini", "gpt-4o-mini", 128000, 0.15, 0.60, 0.4, 80.0),
+    ModelSpec("gpt-4o", "gpt-4o", 128000, 2.50, 10.00, 0.5, 70.0),
+    ModelSpec("gpt-4.1-mini", "gpt-4.1-mini", 1047576, 0.40, 1.60, 0.5, 70.0),
+    ModelSpec("gpt-4.1", "gpt-4.1", 1047576, 2.00, 8.00, 0.6, 60.0),
+]
+
+
+# Function to read a catalog from a JSON file with one object per model, keyed like the ModelSpec fields
+def load_model_catalog(path):
+    with open(path, encoding="utf-8") as catalog_file:
+        entries = json.load(catalog_file)
+    return {entry["name"]: ModelSpec(**entry) for entry in entries}
+
+
+# Function to get the model name the API expects, names that are not in the catalog are sent as they are
+def api_model_name(model_name):
+    spec = model_catalog.get(model_name)
+    return spec.api_name if spec is not None else model_name
+
+
+# Models by their name, in the order they are offered
+model_catalog = (load_model_catalog(MODEL_CATALOG_PATH) if MODEL_CATALOG_PATH
+                 else {spec.name: spec for spec in DEFAULT_MODELS})
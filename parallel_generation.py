@@ -0,0 +1,79 @@
+# Helpers for sending content chunks to the LLM concurrently
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from rate_limiter import EmptyResponseError, RetriesExhaustedError, is_retryable
+
+# Default number of chunk requests that may be in flight at the same time
+DEFAULT_MAX_WORKERS = 4
+
+# Default number of extra attempts for a chunk that failed
+DEFAULT_MAX_RETRIES = 2
+
+
+# Function to generate a response for a single prompt, retrying only this prompt on transient failures
+def generate_with_retry(llm_instance, prompt, max_retries=DEFAULT_MAX_RETRIES, retry_delay=1.0):
+    for attempt in range(max_retries + 1):
+        try:
+            generated_text = llm_instance.generate_response(prompt=prompt)
+            # Some providers return None instead of raising, treat it as a failed attempt
+            if generated_text is not None:
+                return generated_text
+            error = EmptyResponseError("The model returned an empty response")
+        except RetriesExhaustedError:
+            # The shared scheduler already retried this call with backoff
+            raise
+        except Exception as exc:
+            # Errors such as a wrong key or a bad request fail the same way on every attempt
+            if not is_retryable(exc):
+                raise
+            error = exc
+
+        if attempt < max_retries:
+            # Back off a little longer after every failed attempt
+            time.sleep(retry_delay * (2 ** attempt))
+
+    raise error
+
+
+# Function to generate responses for all chunks concurrently, on_done is called with (index, text) per chunk
+def generate_for_chunks(llm_instance, prompt_template, chunks, max_workers=DEFAULT_MAX_WORKERS,
+                        max_retries=DEFAULT_MAX_RETRIES, on_done=None):
+    # Replace placeholder with actual content for every chunk, chunks may still be produced while others are sent
+    prompts = (prompt_template.format(content=chunk) for chunk in chunks)
+    return generate_for_prompts(llm_instance, prompts, max_workers, max_retries, on_done)
+
+
+# Function to generate responses for prompts concurrently, e.g. several tasks over the same chunks,
+# prompts can be a generator that is only read as far as free workers need it
+def generate_for_prompts(llm_instance, prompts, max_workers=DEFAULT_MAX_WORKERS, max_retries=DEFAULT_MAX_RETRIES,
+                         on_done=None):
+    max_workers = max(1, max_workers)
+
+    # Function to generate one prompt and report it as soon as it is finished
+    def generate(index, prompt):
+        generated_text = generate_with_retry(llm_instance, prompt, max_retries)
+        if on_done is not None:
+            on_done(index, generated_text)
+        return generated_text
+
+    futures = []
+    running = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for index, prompt in enumerate(prompts):
+                # Keep a few prompts queued ahead of the workers, not the whole input
+                while len(running) >= max_workers * 2:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        # Stop early when a prompt failed
+                        future.result()
+                future = executor.submit(generate, index, prompt)
+                futures.append(future)
+                running.add(future)
+            # The results stay in the original prompt order
+            return [future.result() for future in futures]
+        except BaseException:
+            # Do not start the prompts that are still waiting once one has failed
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
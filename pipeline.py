@@ -0,0 +1,422 @@
+# Pipeline engine shared by the Streamlit pages and the scripts: load -> split -> generate -> join
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from itertools import chain, islice
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+from chunker import split_blocks, calculate_chunk_size, count_tokens, prompt_overhead_tokens, DEFAULT_RESPONSE_TOKENS
+from content_loader import default_loader, is_youtube_url, normalize_url
+from dedup import DEFAULT_DUPLICATE_THRESHOLD, DuplicateFilter, strip_boilerplate_blocks
+from llm_pool import get_llm, get_openai_client
+from map_reduce import condense_chunks, plan_reduce_depth, reduce_partials
+from model_router import count_content_tokens, plan_models
+from models import AUTO_MODEL, model_catalog
+from parallel_generation import generate_for_prompts, DEFAULT_MAX_WORKERS
+from prompts import default_prompts, build_prompt
+from rate_limiter import ScheduledLLM
+from response_cache import CachedLLM, get_default_cache
+from result_store import get_default_store, hash_content, make_result_key
+from streaming import stream_prompts
+from tracing import Trace, TracedLLM, default_metrics
+
+
+@dataclass
+class ChunkingPolicy:
+    # Context window in tokens, taken from the model catalog when not set
+    context_tokens: Optional[int] = None
+    # Tokens kept free for the model's answer
+    response_tokens: int = DEFAULT_RESPONSE_TOKENS
+    # Merge the outputs of all chunks into one result (map-reduce) instead of joining them
+    merge_outputs: bool = False
+    # Remove navigation, cookie banners and transcript noise of loaded pages before splitting, uploaded files and
+    # text passed in are never changed
+    strip_boilerplate: bool = True
+    # Skip chunks that repeat an earlier chunk exactly or nearly (MinHash similarity at or above the threshold)
+    drop_duplicates: bool = True
+    duplicate_threshold: float = DEFAULT_DUPLICATE_THRESHOLD
+    # With several tasks: condense the content once and run every task on the condensed notes
+    shared_summary: bool = False
+
+
+@dataclass
+class Job:
+    # Source: a URL to load, or text that was already loaded, either as one string or as an iterable
+    # of text blocks (e.g. an uploaded file that is decoded while it is split and sent)
+    url: str = ""
+    text: Optional[object] = None
+    # Prompt: one of the presets filled with the language, or a custom prompt template
+    preset: str = "Student Notes"
+    language: str = "German"
+    custom_prompt: Optional[str] = None
+    # Several presets that are all generated from one load of the content, used instead of preset when set
+    presets: list = field(default_factory=list)
+    # Model and credentials, without a key the OPENAI_API_KEY environment variable is used;
+    # with AUTO_MODEL the model with the best plan for the loaded content is set once it is measured
+    model: str = "gpt-3.5-turbo"
+    api_key: Optional[str] = None
+    chunking: ChunkingPolicy = field(default_factory=ChunkingPolicy)
+    # Number of chunk requests in flight at the same time
+    max_workers: int = DEFAULT_MAX_WORKERS
+    # Pass responses on token by token through the hooks
+    stream: bool = False
+    # Response cache: use it at all, and skip cached answers while still storing new ones
+    use_cache: bool = True
+    bypass_cache: bool = False
+
+    # The prompt template of every task by its name, the presets give their content after the instructions;
+    # a custom prompt is used as the user wrote it
+    @property
+    def task_templates(self):
+        presets = self.presets or ([] if self.custom_prompt else [self.preset])
+        templates = {preset: build_prompt(default_prompts[preset], self.language) for preset in presets}
+        if self.custom_prompt:
+            templates["Custom Prompt"] = self.custom_prompt
+        return templates
+
+    # The prompt template of the first task, the only one unless several tasks are selected
+    @property
+    def prompt_template(self):
+        return next(iter(self.task_templates.values()))
+
+    # The context window used to size the chunks
+    @property
+    def context_tokens(self):
+        return self.chunking.context_tokens or model_catalog[self.model].context_tokens
+
+
+@dataclass
+class JobResult:
+    # Output and chunk outputs of the first task
+    output: str
+    chunk_outputs: list
+    num_chunks: int
+    content_chars: int
+    # Seconds spent in each stage: load, route (Auto model only), read, clean, chunk, dedupe, generate and
+    # (in map-reduce mode) reduce,
+    # reading to deduping happen while the chunks are generated, so their time is also part of generate
+    timings: dict
+    # Spans of the stages, content loading steps and every LLM call
+    trace: Trace
+    # Chunks that were not sent because they repeat an earlier one
+    duplicate_chunks: int = 0
+    # Output of every task by its name
+    outputs: dict = field(default_factory=dict)
+    # Prompt tokens of the generate calls spent on instructions and on content
+    instruction_tokens: int = 0
+    content_tokens: int = 0
+
+    # Instruction tokens sent per content token, lower means less is paid for repeating the prompt
+    @property
+    def instruction_ratio(self):
+        return self.instruction_tokens / max(self.content_tokens, 1)
+
+
+class PipelineHooks:
+    # Base class for hooks, override the methods you need
+
+    # Called when a stage starts
+    def on_stage_start(self, stage, job):
+        pass
+
+    # Called after every stage with its duration in seconds
+    def on_stage(self, stage, seconds, job):
+        pass
+
+    # Called once all content is split, with the number of chunks that were sent
+    def on_chunks(self, num_chunks, job):
+        pass
+
+    # Called before a batch of LLM calls starts, the indexes of the calls start at 0 again
+    def on_batch(self, job):
+        pass
+
+    # Called when a call of the current batch is queued, with a label like "Student Notes, chunk 3"
+    def on_call(self, index, label, job):
+        pass
+
+    # Called right before a request is sent to the model and while it waits for the rate limit, raise to stop
+    def on_call_start(self, job):
+        pass
+
+    # Called for every streaming event ("delta", "restart" or "done") of a chunk
+    def on_stream_event(self, event, index, text, job):
+        pass
+
+    # Called with the output of a call once it is complete, from a worker thread when not streaming
+    def on_chunk_done(self, index, text, job):
+        pass
+
+
+# Function to time a stage, record it in the trace and report it to all hooks
+@contextmanager
+def _stage(name, job, hooks, timings, trace):
+    for hook in hooks:
+        hook.on_stage_start(name, job)
+    started = time.perf_counter()
+    with trace.span(name) as stage:
+        yield stage
+    timings[name] = time.perf_counter() - started
+    for hook in hooks:
+        hook.on_stage(name, timings[name], job)
+
+
+# Function to build the LLM instance for a job: pooled client, shared scheduler and response cache
+def build_llm(job, hooks=()):
+    llm_instance = ScheduledLLM(get_llm(job.model, job.api_key), job.model, api_key=job.api_key,
+                                before_call=_before_call(hooks, job))
+    if job.use_cache:
+        llm_instance = CachedLLM(llm_instance, job.model, get_default_cache(), bypass=job.bypass_cache)
+    return llm_instance
+
+
+# Function to build the check that runs before every request of a job
+def _before_call(hooks, job):
+    def before_call():
+        for hook in hooks:
+            hook.on_call_start(job)
+    return before_call
+
+
+# Function to calculate the number of reduce levels a job will need for its chunks
+def plan_job_reduce_depth(job, num_chunks):
+    return plan_reduce_depth(num_chunks, job.context_tokens, job.prompt_template, job.model)
+
+
+# Function to run a job from loading the content to the combined output
+def run_job(job, hooks=(), llm_instance=None, loader=None, trace=None):
+    # Callers that pass their own trace keep it even when the job fails
+    trace = trace or Trace()
+    trace.attributes.update(model=job.model, url=job.url, tasks=list(job.task_templates), stream=job.stream,
+                            merge_outputs=job.chunking.merge_outputs)
+    try:
+        return _run_job(job, hooks, llm_instance, loader, trace)
+    finally:
+        # Process-wide counters and histograms for capacity planning, failed jobs included
+        default_metrics.record_trace(trace)
+
+
+class _LazyStage:
+    # Stage whose items are produced on demand, its time is added up while the items are pulled
+    def __init__(self, name, items, upstream=None):
+        self.name = name
+        self.items = items
+        self.upstream = upstream
+        self.count = 0
+        self.chars = 0
+        self.started = None
+        self._inclusive = 0.0
+
+    def __iter__(self):
+        iterator = iter(self.items)
+        while True:
+            started = time.perf_counter()
+            self.started = self.started or started
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._inclusive += time.perf_counter() - started
+            self.count += 1
+            self.chars += len(item)
+            yield item
+
+    # Seconds spent in this stage, without the time of the stage it reads from
+    @property
+    def seconds(self):
+        return self._inclusive - (self.upstream._inclusive if self.upstream else 0.0)
+
+
+# Function to pass every finished call of a batch on to the hooks
+def _notify_done(hooks, job):
+    def on_done(index, text):
+        for hook in hooks:
+            hook.on_chunk_done(index, text, job)
+    return on_done
+
+
+# Function to announce (item, label) pairs to the hooks as the calls of the current batch, passing the items on
+def _announce(labeled_items, hooks, job):
+    for index, (item, label) in enumerate(labeled_items):
+        for hook in hooks:
+            hook.on_call(index, label, job)
+        yield item
+
+
+# Function to build the prompts of all tasks chunk by chunk, so each chunk is sent as soon as it is split,
+# the instruction and content tokens of all prompts are added up in usage
+def _task_prompts(chunks, tasks, single_chunk, model_name, usage):
+    instruction_tokens = {name: prompt_overhead_tokens(template, model_name) for name, template in tasks.items()}
+    for i, chunk in enumerate(chunks):
+        usage["content_tokens"] += count_tokens(chunk, model_name) * len(tasks)
+        for name, template in tasks.items():
+            usage["instruction_tokens"] += instruction_tokens[name]
+            yield template.format(content=chunk), name if single_chunk else f"{name}, chunk {i + 1}"
+
+
+# Function to send a batch of prompts, streaming them token by token if the job asks for it
+def _generate_batch(job, hooks, llm_instance, trace, prompts, stage):
+    if not job.stream:
+        return generate_for_prompts(TracedLLM(llm_instance, job.model, trace, stage=stage), prompts,
+                                    max_workers=job.max_workers, on_done=_notify_done(hooks, job))
+
+    outputs = []
+    cache = get_default_cache() if job.use_cache else None
+    events = stream_prompts(get_openai_client(job.api_key), job.model, prompts, max_workers=job.max_workers,
+                            cache=cache, bypass_cache=job.bypass_cache, trace=trace, api_key=job.api_key,
+                            before_call=_before_call(hooks, job))
+    # Closed right away when a hook stops the job, so the prompts that have not started are dropped
+    with closing(events):
+        for event, index, text in events:
+            # Prompts are read lazily, so the list grows with the highest index seen so far
+            outputs.extend([""] * (index + 1 - len(outputs)))
+            if event == "delta":
+                outputs[index] += text
+            elif event == "restart":
+                outputs[index] = ""
+            elif event == "done":
+                outputs[index] = text
+            for hook in hooks:
+                hook.on_stream_event(event, index, text, job)
+                if event == "done":
+                    hook.on_chunk_done(index, text, job)
+    return outputs
+
+
+# Function to run the stages of a job, recording them in the given trace
+def _run_job(job, hooks, llm_instance, loader, trace):
+    timings = {}
+
+    with _stage("load", job, hooks, timings, trace):
+        content = job.text if job.text is not None else (loader or default_loader).load(job.url)
+
+    if job.model == AUTO_MODEL:
+        with _stage("route", job, hooks, timings, trace) as stage:
+            # Streamed content has to be measured as a whole before the first chunk can be sized
+            content = content if isinstance(content, str) else "".join(content)
+            content_tokens = count_content_tokens(content, job.model)
+            job.model = plan_models(job, content_tokens)[0].model
+            trace.attributes["model"] = job.model
+            stage.attributes.update(content_tokens=content_tokens, model=job.model)
+    llm_instance = llm_instance or build_llm(job, hooks)
+    # Uploaded files have no URL to share their results by
+    if not job.url or job.text is not None or not job.use_cache:
+        return _process_content(job, hooks, llm_instance, content, timings, trace)
+
+    # Finished results of the same request and content are shared by all sessions and jobs of the server
+    store = get_default_store()
+    content_hash = hash_content(content)
+    key = make_result_key(job, content_hash)
+    with trace.span("result_store") as lookup:
+        # Results of an earlier version of the page or transcript are never served again
+        store.invalidate(job.url, content_hash)
+        stored = None if job.bypass_cache else store.get(key)
+        lookup.attributes["hit"] = stored is not None
+    if stored is not None:
+        trace.attributes["result_store"] = "hit"
+        return JobResult(timings=timings, trace=trace, **stored)
+
+    # Function to run the job and store its result, only one job per key runs at a time
+    def process_and_store():
+        result = _process_content(job, hooks, llm_instance, content, timings, trace)
+        store.put(key, job.url, content_hash, _stored_fields(result))
+        return result
+
+    result = store.run_once(key, process_and_store)
+    if result.trace is trace:
+        return result
+    # Another job with the same key was already running, its result is used instead of generating again
+    trace.attributes["result_store"] = "shared"
+    return JobResult(timings=timings, trace=trace, **_stored_fields(result))
+
+
+# Function to get the fields of a result that are stored and shared, without the timings and trace of its job
+def _stored_fields(result):
+    return {result_field.name: getattr(result, result_field.name) for result_field in fields(result)
+            if result_field.name not in ("timings", "trace")}
+
+
+# Function to clean, split, dedupe and generate loaded content
+def _process_content(job, hooks, llm_instance, content, timings, trace):
+    tasks = job.task_templates
+
+    # The task with the longest prompt decides how much content fits into one call
+    chunk_size = min(calculate_chunk_size(job.context_tokens, template, job.model,
+                                          response_tokens=job.chunking.response_tokens)
+                     for template in tasks.values())
+
+    # Reading, cleaning, splitting and deduping run lazily: blocks and chunks flow into the generation
+    # batch while the rest of the content is still read, so a large upload is never held as a whole
+    reading = _LazyStage("read", [content] if isinstance(content, str) else content)
+    lazy_stages = [reading]
+    blocks = reading
+    if job.chunking.strip_boilerplate and job.url and job.text is None:
+        transcript = is_youtube_url(normalize_url(job.url))
+        blocks = _LazyStage("clean", strip_boilerplate_blocks(blocks, transcript), upstream=reading)
+        lazy_stages.append(blocks)
+    chunks = _LazyStage("chunk", split_blocks(blocks, chunk_size, job.model), upstream=blocks)
+    lazy_stages.append(chunks)
+    duplicate_filter = DuplicateFilter(job.chunking.duplicate_threshold)
+    if job.chunking.drop_duplicates:
+        chunks = _LazyStage("dedupe", duplicate_filter.filter(chunks), upstream=chunks)
+        lazy_stages.append(chunks)
+
+    # Look at the first two chunks to know if the content needs more than one call per task
+    chunks = iter(chunks)
+    head = list(islice(chunks, 2))
+    chunks = chain(head, chunks)
+
+    # Condensing costs one call per chunk, instead of one call per chunk for every task but the first
+    if job.chunking.shared_summary and len(tasks) > 1 and len(head) > 1:
+        with _stage("condense", job, hooks, timings, trace) as stage:
+            for hook in hooks:
+                hook.on_batch(job)
+            labeled_chunks = ((chunk, f"Condense, chunk {i + 1}") for i, chunk in enumerate(chunks))
+            chunks = [condense_chunks(TracedLLM(llm_instance, job.model, trace, stage="condense"),
+                                      _announce(labeled_chunks, hooks, job), job.model, chunk_size,
+                                      job.context_tokens, max_workers=job.max_workers,
+                                      on_done=_notify_done(hooks, job))]
+            head = chunks
+            stage.attributes["chars"] = len(chunks[0])
+
+    usage = {"instruction_tokens": 0, "content_tokens": 0}
+    with _stage("generate", job, hooks, timings, trace) as stage:
+        for hook in hooks:
+            hook.on_batch(job)
+        # All tasks over all chunks go out as one batch, so they share the parallel requests
+        prompts = _announce(_task_prompts(chunks, tasks, len(head) == 1, job.model, usage), hooks, job)
+        generated = _generate_batch(job, hooks, llm_instance, trace, prompts, "generate")
+        task_chunk_outputs = {name: generated[i::len(tasks)] for i, name in enumerate(tasks)}
+        stage.attributes.update(usage, instruction_ratio=round(usage["instruction_tokens"] /
+                                                               max(usage["content_tokens"], 1), 4))
+
+    # The lazy stages are finished once the last chunk was generated
+    stage_attributes = {"chunk": {"chunk_size": chunk_size},
+                        "dedupe": {"duplicate_chunks": len(duplicate_filter.duplicates)}}
+    for lazy_stage in lazy_stages:
+        timings[lazy_stage.name] = lazy_stage.seconds
+        trace.record(lazy_stage.name, lazy_stage.started or time.perf_counter(), lazy_stage.seconds,
+                     items=lazy_stage.count, chars=lazy_stage.chars, **stage_attributes.get(lazy_stage.name, {}))
+        for hook in hooks:
+            hook.on_stage(lazy_stage.name, lazy_stage.seconds, job)
+    num_chunks = lazy_stages[-1].count
+    for hook in hooks:
+        hook.on_chunks(num_chunks, job)
+
+    outputs = {name: "\n".join(chunk_outputs) for name, chunk_outputs in task_chunk_outputs.items()}
+    if job.chunking.merge_outputs and len(generated) > len(tasks):
+        with _stage("reduce", job, hooks, timings, trace):
+            reduce_llm = TracedLLM(llm_instance, job.model, trace, stage="reduce")
+            # The merge trees of the tasks are independent and run side by side
+            with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+                futures = {name: executor.submit(reduce_partials, reduce_llm, tasks[name], chunk_outputs,
+                                                 job.model, job.context_tokens, max_workers=job.max_workers)
+                           for name, chunk_outputs in task_chunk_outputs.items()}
+                outputs = {name: future.result() for name, future in futures.items()}
+
+    first_task = next(iter(tasks))
+    return JobResult(output=outputs[first_task], chunk_outputs=task_chunk_outputs[first_task], num_chunks=num_chunks,
+                     content_chars=reading.chars, timings=timings, trace=trace,
+                     duplicate_chunks=len(duplicate_filter.duplicates), outputs=outputs, **usage)
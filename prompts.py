@@ -0,0 +1,30 @@
+# Prompt presets shared by the Streamlit pages and the batch script
+import textwrap
+
+# Default prompts
+default_prompts = {
+    "Instagram Post": """
+    Act as if you're a social media expert.
+    I want you to create 5 different Instagram posts in {language} based on the Content. 
+    The thread should be optimized for virality and contain 
+    relevant hashtags and a catchy caption. Stop when you created exactly 5 Posts.
+    Content: {content}""",
+
+    "Tweet Post": """
+    Act as if you're a social media expert. 
+    Give me a 10 tweet thread based on the Content. 
+    The thread should be optimized for virality and contain 
+    hashtags and emoticons. Each tweet should not exceed 280 characters in length.
+    Content: {content}""",
+
+    "Student Notes": """
+    I want you to create summary notes in {language} based on the Content. 
+    Summarize the key points as if you were taking notes to learn from the content.
+    Content: {content}"""
+}
+
+
+# Function to fill the language into a prompt template, the content placeholder stays
+def build_prompt(prompt_template, language):
+    # The indentation of the presets would be sent again with every chunk
+    return textwrap.dedent(prompt_template).strip().replace("{language}", language)
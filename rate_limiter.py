@@ -0,0 +1,235 @@
+# Shared scheduler for LLM calls: requests/tokens per minute budgets and retries with backoff
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from chunker import count_tokens
+from tracing import increment
+
+# Default budgets per model, can be changed with the LLM_RPM and LLM_TPM environment variables
+DEFAULT_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_RPM", 500))
+DEFAULT_TOKENS_PER_MINUTE = float(os.environ.get("LLM_TPM", 90000))
+
+# Tokens reserved for the answer of every call, SimplerLLM limits responses to 300 tokens by default
+DEFAULT_RESPONSE_TOKENS = 300
+
+# Retry settings for throttled and failed calls
+DEFAULT_MAX_RETRIES = 5
+BASE_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+# HTTP status codes that are worth another attempt
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Length of the sliding window the budgets are measured over, in seconds
+WINDOW_SECONDS = 60.0
+
+# Seconds between two checks of before_call while a call waits for the budget
+BEFORE_CALL_INTERVAL = 0.5
+
+
+class RetriesExhaustedError(RuntimeError):
+    # Raised when a call still fails after all retries of the scheduler
+    pass
+
+
+class EmptyResponseError(RuntimeError):
+    # Raised when the model returns no text, SimplerLLM does this after its own retries failed
+    pass
+
+
+# Function to read the HTTP status code of an API error, if there is one
+def get_status_code(exc):
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exc, "response", None), "status_code", None)
+    return status_code
+
+
+# Function to read the Retry-After header of an API error in seconds
+def get_retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Retry-After can also be an HTTP date
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Function to check if a failed call should be tried again
+def is_retryable(exc):
+    if isinstance(exc, EmptyResponseError):
+        return True
+    status_code = get_status_code(exc)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # Connection problems and timeouts have no status code
+    return any(name in type(exc).__name__ for name in ("Connection", "Timeout"))
+
+
+# Function to identify an API key in the budgets without keeping the key itself, None stands for the environment key
+def hash_api_key(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else None
+
+
+class ModelBudget:
+    # Track the requests and tokens of one model and API key over the last minute
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # The allowed request rate shrinks after throttling and grows back after successful calls
+        self.allowed_requests_per_minute = requests_per_minute
+        self.paused_until = 0.0
+        self._calls = deque()
+        self._tokens = 0
+        self._condition = threading.Condition()
+
+    # Drop calls that left the sliding window
+    def _expire(self, now):
+        while self._calls and now - self._calls[0][0] >= WINDOW_SECONDS:
+            self._tokens -= self._calls.popleft()[1]
+
+    # Block until a call with the given number of tokens fits into the budget; before_call is called
+    # while waiting and right before the call is let through, and may raise to give up the call
+    def acquire(self, tokens, before_call=None):
+        # A single call larger than the whole budget may still run once the window is empty
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._condition:
+            while True:
+                if before_call is not None:
+                    before_call()
+                now = time.monotonic()
+                self._expire(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if len(self._calls) >= self.allowed_requests_per_minute:
+                        wait = self._calls[0][0] + WINDOW_SECONDS - now
+                    elif self._tokens + tokens > self.tokens_per_minute:
+                        wait = self._calls[0][0] + WINDOW_SECONDS - now
+                    else:
+                        self._calls.append((now, tokens))
+                        self._tokens += tokens
+                        return
+                if before_call is not None:
+                    wait = min(wait, BEFORE_CALL_INTERVAL)
+                self._condition.wait(max(wait, 0.01))
+
+    # Slowly raise the allowed rate again after a successful call
+    def record_success(self):
+        with self._condition:
+            self.allowed_requests_per_minute = min(self.requests_per_minute, self.allowed_requests_per_minute + 1)
+
+    # Pause all callers of this model and key and halve the allowed rate after the API throttled a call
+    def record_throttle(self, delay):
+        with self._condition:
+            self.allowed_requests_per_minute = max(1, self.allowed_requests_per_minute // 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._condition.notify_all()
+
+
+class RequestScheduler:
+    # Create a scheduler with one budget per API key and model, so a throttled key never slows down other users
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    # Set the budget of a model, e.g. from the limits of the API account
+    def configure(self, model_name, requests_per_minute=None, tokens_per_minute=None, api_key=None):
+        with self._lock:
+            self._budgets[(hash_api_key(api_key), model_name)] = ModelBudget(
+                requests_per_minute or self.requests_per_minute, tokens_per_minute or self.tokens_per_minute)
+
+    # Return the budget of a model and API key, creating it with the defaults on first use
+    def budget(self, model_name, api_key=None):
+        key = (hash_api_key(api_key), model_name)
+        with self._lock:
+            if key not in self._budgets:
+                self._budgets[key] = ModelBudget(self.requests_per_minute, self.tokens_per_minute)
+            return self._budgets[key]
+
+    # Function to estimate the tokens a prompt uses, including the reserved answer
+    def estimate_tokens(self, model_name, prompt):
+        return count_tokens(prompt, model_name) + DEFAULT_RESPONSE_TOKENS
+
+    # Wait until the budget of the model and key allows another call
+    def acquire(self, model_name, prompt, api_key=None, before_call=None):
+        started = time.perf_counter()
+        self.budget(model_name, api_key).acquire(self.estimate_tokens(model_name, prompt), before_call)
+        increment("queue_seconds", time.perf_counter() - started)
+
+    # Return the delay before the next attempt, or None if the error should not be retried
+    def retry_delay(self, model_name, exc, attempt, api_key=None):
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return None
+        # Full jitter keeps many throttled callers from retrying at the same moment
+        delay = random.uniform(0, min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * (2 ** attempt)))
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if get_status_code(exc) == 429:
+            self.budget(model_name, api_key).record_throttle(delay)
+        return delay
+
+    # Run a call within the budget of the model and key and retry it on throttling and transient errors
+    def call(self, model_name, prompt, func, api_key=None, before_call=None):
+        attempt = 0
+        while True:
+            self.acquire(model_name, prompt, api_key, before_call)
+            try:
+                result = func()
+                if result is None:
+                    raise EmptyResponseError("The model returned an empty response")
+                self.budget(model_name, api_key).record_success()
+                return result
+            except Exception as exc:
+                delay = self.retry_delay(model_name, exc, attempt, api_key)
+                if delay is None:
+                    if attempt and is_retryable(exc):
+                        raise RetriesExhaustedError(f"Failed after {attempt + 1} attempts: {exc}") from exc
+                    raise
+                increment("retries")
+                time.sleep(delay)
+                attempt += 1
+
+
+class ScheduledLLM:
+    # Wrap an LLM instance so every call goes through the shared scheduler, within the budget of its API key;
+    # before_call can stop a call that is still waiting, e.g. of a cancelled job
+    def __init__(self, llm_instance, model_name, scheduler=None, api_key=None, before_call=None):
+        self.llm_instance = llm_instance
+        self.model_name = model_name
+        self.scheduler = scheduler or default_scheduler
+        self.api_key = api_key
+        self.before_call = before_call
+
+    # Same interface as the wrapped LLM instance
+    def generate_response(self, prompt, **kwargs):
+        return self.scheduler.call(self.model_name, prompt,
+                                   lambda: self.llm_instance.generate_response(prompt=prompt, **kwargs),
+                                   api_key=self.api_key, before_call=self.before_call)
+
+
+# Scheduler shared by all Streamlit sessions and threads of this process
+default_scheduler = RequestScheduler()
@@ -0,0 +1,116 @@
+# Disk-backed cache for LLM responses, keyed by model name and the fully formatted prompt
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from tracing import annotate
+
+# Location of the cache database, can be changed with the LLM_CACHE_PATH environment variable
+DEFAULT_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+
+# Maximum number of responses kept before the least recently used ones are evicted
+DEFAULT_MAX_ENTRIES = 10000
+
+# Optional lifetime of a cached response in seconds, set with the LLM_CACHE_TTL environment variable
+DEFAULT_TTL_SECONDS = float(os.environ["LLM_CACHE_TTL"]) if os.environ.get("LLM_CACHE_TTL") else None
+
+# Shared cache instance, created on first use
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+# Function to build the cache key for a model and prompt
+def make_cache_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Open (or create) the cache database
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    # Return the cached response, or None if it is missing or expired
+    def get(self, model_name, prompt):
+        key = make_cache_key(model_name, prompt)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            # Remember the access time for LRU eviction
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return response
+
+    # Store a response and evict the least recently used entries above the size limit
+    def set(self, model_name, prompt, response):
+        key = make_cache_key(model_name, prompt)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    # Remove all cached responses
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+
+class CachedLLM:
+    # Wrap an LLM instance so repeated prompts are answered from the cache
+    def __init__(self, llm_instance, model_name, cache, bypass=False):
+        self.llm_instance = llm_instance
+        self.model_name = model_name
+        self.cache = cache
+        self.bypass = bypass
+
+    # Same interface as the wrapped LLM instance
+    def generate_response(self, prompt, **kwargs):
+        # The key only covers model and prompt, so calls with extra options are never cached
+        if kwargs:
+            return self.llm_instance.generate_response(prompt=prompt, **kwargs)
+
+        if not self.bypass:
+            cached = self.cache.get(self.model_name, prompt)
+            if cached is not None:
+                annotate(cache_hit=True)
+                return cached
+
+        generated_text = self.llm_instance.generate_response(prompt=prompt)
+
+        # Fresh results are stored even when the cache is bypassed, so the next run can use them
+        if generated_text is not None:
+            self.cache.set(self.model_name, prompt, generated_text)
+        return generated_text
+
+
+# Function to get the cache shared by all sessions of this process
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
@@ -0,0 +1,144 @@
+# Server-wide store of finished job results, keyed by the request and a hash of the loaded content
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict
+
+from content_loader import normalize_url
+from tracing import annotate
+
+# Location of the store database, can be changed with the RESULT_STORE_PATH environment variable
+DEFAULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH", ".result_store.sqlite3")
+
+# Maximum number of results kept before the least recently used ones are evicted
+DEFAULT_MAX_ENTRIES = 2000
+
+# Optional lifetime of a stored result in seconds, set with the RESULT_STORE_TTL environment variable
+DEFAULT_TTL_SECONDS = float(os.environ["RESULT_STORE_TTL"]) if os.environ.get("RESULT_STORE_TTL") else None
+
+# Shared store instance, created on first use
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+# Function to describe everything of a URL job that changes its output, except the content itself
+def request_fingerprint(job):
+    return json.dumps({"url": normalize_url(job.url), "tasks": job.task_templates, "model": job.model,
+                       "chunking": asdict(job.chunking)}, sort_keys=True, ensure_ascii=False)
+
+
+# Function to get the key under which identical queued or running requests share one job, None for jobs that
+# never share: loaded text, jobs without the cache and jobs that bypass it to ask for a fresh answer
+def shared_request_key(job):
+    if job.url and job.text is None and job.use_cache and not job.bypass_cache:
+        return request_fingerprint(job)
+    return None
+
+
+# Function to hash loaded content
+def hash_content(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# Function to build the store key of a job and the hash of its loaded content
+def make_result_key(job, content_hash):
+    return hashlib.sha256(f"{request_fingerprint(job)}\0{content_hash}".encode("utf-8")).hexdigest()
+
+
+class ResultStore:
+    # Open (or create) the store database
+    def __init__(self, path=DEFAULT_STORE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, url TEXT, content_hash TEXT, result TEXT, created_at REAL, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_url ON results (url)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    # Return the stored result fields, or None if they are missing or expired
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT result, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            result, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            # Remember the access time for LRU eviction
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+            return json.loads(result)
+
+    # Store result fields and evict the least recently used entries above the size limit
+    def put(self, key, url, content_hash, result):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, url, content_hash, result, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, normalize_url(url), content_hash, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    # Remove the results of a URL that were made from other content than the current one
+    def invalidate(self, url, content_hash):
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM results WHERE url = ? AND content_hash != ?",
+                                         (normalize_url(url), content_hash)).rowcount
+        if removed:
+            annotate(invalidated_results=removed)
+        return removed
+
+    # Run compute once per key at a time, concurrent callers with the same key wait for its return value
+    def run_once(self, key, compute):
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            value = compute()
+            future.set_result(value)
+            return value
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    # Remove all stored results
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results")
+
+
+# Function to get the store shared by all sessions of this process
+def get_default_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ResultStore()
+        return _default_store
@@ -0,0 +1,142 @@
+# Streaming generation: chunk responses are passed on token by token while they are generated
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chunker import count_tokens
+from models import api_model_name
+from parallel_generation import DEFAULT_MAX_WORKERS
+from rate_limiter import default_scheduler
+from tracing import Trace
+
+# Same defaults as SimplerLLM's generate_response, so both modes give comparable answers
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI Assistant"
+DEFAULT_MAX_TOKENS = 300
+
+
+# Function to stream the response for one prompt as text pieces
+def stream_response(client, model_name, prompt, system_prompt=DEFAULT_SYSTEM_PROMPT, max_tokens=DEFAULT_MAX_TOKENS):
+    stream = client.chat.completions.create(
+        model=api_model_name(model_name),
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+
+
+# Function to stream one chunk into the event queue, every failure ends as an error event so the reader never
+# waits for a chunk whose worker is gone
+def _stream_chunk(client, model_name, index, prompt, events, cache, bypass_cache, scheduler, trace, api_key,
+                  before_call):
+    try:
+        _stream_chunk_events(client, model_name, index, prompt, events, cache, bypass_cache, scheduler, trace,
+                             api_key, before_call)
+    except Exception as exc:
+        events.put(("error", index, exc))
+
+
+# Function to stream one chunk, retrying only this chunk when the API call fails
+def _stream_chunk_events(client, model_name, index, prompt, events, cache, bypass_cache, scheduler, trace, api_key,
+                         before_call):
+    with trace.span("llm_call", model=model_name, stage="generate", chunk=index, cache_hit=False) as call:
+        # Cached answers are sent as one piece
+        if cache is not None and not bypass_cache:
+            cached = cache.get(model_name, prompt)
+            if cached is not None:
+                call.attributes.update(cache_hit=True, prompt_tokens=count_tokens(prompt, model_name),
+                                       completion_tokens=count_tokens(cached, model_name))
+                events.put(("delta", index, cached))
+                events.put(("done", index, cached))
+                return
+
+        attempt = 0
+        while True:
+            pieces = []
+            # Wait for the shared requests/tokens per minute budget of the model and key
+            scheduler.acquire(model_name, prompt, api_key, before_call)
+            started = time.perf_counter()
+            try:
+                for piece in stream_response(client, model_name, prompt):
+                    if not pieces:
+                        call.attributes["first_token_seconds"] = round(time.perf_counter() - started, 6)
+                    pieces.append(piece)
+                    events.put(("delta", index, piece))
+                scheduler.budget(model_name, api_key).record_success()
+                break
+            except Exception as exc:
+                delay = scheduler.retry_delay(model_name, exc, attempt, api_key)
+                if delay is None:
+                    call.attributes["error"] = type(exc).__name__
+                    events.put(("error", index, exc))
+                    return
+                # Tell the reader to throw away what was shown for this chunk so far
+                events.put(("restart", index, None))
+                call.attributes["retries"] = call.attributes.get("retries", 0) + 1
+                time.sleep(delay)
+                attempt += 1
+
+        generated_text = "".join(pieces)
+        call.attributes.update(prompt_tokens=count_tokens(prompt, model_name),
+                               completion_tokens=count_tokens(generated_text, model_name))
+        if cache is not None:
+            cache.set(model_name, prompt, generated_text)
+        events.put(("done", index, generated_text))
+
+
+# Function to stream all chunks concurrently, yielding (event, chunk index, text) tuples
+def stream_chunks(client, model_name, prompt_template, chunks, max_workers=DEFAULT_MAX_WORKERS,
+                  cache=None, bypass_cache=False, scheduler=default_scheduler, trace=None, api_key=None,
+                  before_call=None):
+    prompts = (prompt_template.format(content=chunk) for chunk in chunks)
+    return stream_prompts(client, model_name, prompts, max_workers, cache, bypass_cache, scheduler, trace, api_key,
+                          before_call)
+
+
+# Function to stream prompts concurrently, yielding (event, prompt index, text) tuples,
+# prompts can be a generator that is only read as far as free workers need it,
+# api_key is the key of the client and selects its budget in the scheduler, before_call is checked before
+# every request is sent (see ScheduledLLM)
+def stream_prompts(client, model_name, prompts, max_workers=DEFAULT_MAX_WORKERS, cache=None, bypass_cache=False,
+                   scheduler=default_scheduler, trace=None, api_key=None, before_call=None):
+    max_workers = max(1, max_workers)
+    prompts = iter(prompts)
+    events = queue.Queue()
+    # Without a trace of the caller the spans are recorded in a throwaway one
+    trace = trace or Trace()
+
+    # Events are produced by worker threads but consumed in the caller's thread,
+    # so Streamlit elements are only ever updated from the script thread
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        index = 0
+        remaining = 0
+        exhausted = False
+        try:
+            while True:
+                # Keep a few prompts queued ahead of the workers, not the whole input
+                while not exhausted and remaining < max_workers * 2:
+                    prompt = next(prompts, None)
+                    if prompt is None:
+                        exhausted = True
+                        break
+                    executor.submit(_stream_chunk, client, model_name, index, prompt, events, cache, bypass_cache,
+                                    scheduler, trace, api_key, before_call)
+                    index += 1
+                    remaining += 1
+                if not remaining:
+                    break
+
+                event = events.get()
+                if event[0] == "error":
+                    raise event[2]
+                if event[0] == "done":
+                    remaining -= 1
+                yield event
+        finally:
+            # After an error, or when the reader stops (e.g. a cancelled job), chunks that have not started are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,9 @@
-from SimplerLLM.language.llm import LLM, LLMProvider
-from SimplerLLM.tools.generic_loader import load_content
+from pipeline import Job, ChunkingPolicy, run_job
 
 
-llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name="gpt-3.5-turbo-1106")
-
 url = "https://www.rad1.de/gazelle/"
 
-content = load_content(url).content
-
-Q_A_prompt = f"""In den folgenden Eingaben werde ich dir einen Text geben, den du für mich zusammenfassen sollst.
+Q_A_prompt = """In den folgenden Eingaben werde ich dir einen Text geben, den du für mich zusammenfassen sollst.
 
 Erstelle eine kurze Zusammenfassung des Artikels in wenigen Sätzen.
 Erstelle eine Q&A oder FAQ-Sektion mit möglichen Fragen und Antworten, basierend auf dem Artikel.
@@ -21,6 +16,7 @@ Hier sind die Parameter für die Zusammenfassung:
 
 Text: {content}"""
 
-generated_text = llm_instance.generate_response(prompt=Q_A_prompt)
+job = Job(url=url, custom_prompt=Q_A_prompt, model="gpt-3.5-turbo-1106", chunking=ChunkingPolicy(context_tokens=16385))
+generated_text = run_job(job).output
 
 print(generated_text)
\ No newline at end of file
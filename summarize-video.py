@@ -1,14 +1,9 @@
-from SimplerLLM.language.llm import LLM, LLMProvider
-from SimplerLLM.tools.generic_loader import load_content
+from pipeline import Job, ChunkingPolicy, run_job
 
 
-llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name="gpt-3.5-turbo-1106")
-
 url = "https://youtu.be/MOyl58VF2ak?si=T4eN18oqZLk0BeYW"
 
-content = load_content(url).content
-
-youtube_to_points_summary = f"""I want you to only answer in German. 
+youtube_to_points_summary = """I want you to only answer in German. 
 Please extract key takeaways of the Content. 
 Each key takeaway should be a list item, of the following format:
 "- [relevant emoji] [takeaway]"
@@ -16,6 +11,8 @@ Keep emoji unique to each takeaway item.
 Please try to use different emojis for each takeaway. Do not render brackets.
 Content: {content}"""
 
-generated_text = llm_instance.generate_response(prompt=youtube_to_points_summary)
+job = Job(url=url, custom_prompt=youtube_to_points_summary, model="gpt-3.5-turbo-1106",
+          chunking=ChunkingPolicy(context_tokens=16385))
+generated_text = run_job(job).output
 
 print(generated_text)
\ No newline at end of file
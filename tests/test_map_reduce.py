@@ -0,0 +1,37 @@
+# Regression tests of the merge tree of map_reduce
+from map_reduce import PARTIAL_SEPARATOR, condense_chunks, reduce_partials
+
+
+class FakeLLM:
+    # LLM that answers every prompt with the same fixed text and counts its calls
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    def generate_response(self, prompt, **kwargs):
+        self.calls += 1
+        return self.answer
+
+
+# Partials that never fit into one reduce prompt together must not make the tree loop forever
+def test_reduce_stops_when_partials_cannot_be_merged():
+    llm = FakeLLM("word " * 300)
+    partials = ["word " * 300] * 4
+    output = reduce_partials(llm, "Summarize: {content}", partials, "gpt-3.5-turbo", 1800)
+    assert llm.calls < 10
+    assert output.count(PARTIAL_SEPARATOR) == 3
+
+
+# Partials that fit together are still merged into one result
+def test_reduce_merges_partials_that_fit():
+    llm = FakeLLM("merged")
+    output = reduce_partials(llm, "Summarize: {content}", ["short partial"] * 6, "gpt-3.5-turbo", 4096)
+    assert output == "merged"
+    assert llm.calls == 1
+
+
+# Condensing stops as well when the notes cannot get shorter
+def test_condense_stops_when_notes_cannot_be_merged():
+    llm = FakeLLM("note " * 300)
+    condense_chunks(llm, ["text " * 300] * 4, "gpt-3.5-turbo", 500, 1800)
+    assert llm.calls < 10
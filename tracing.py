@@ -0,0 +1,271 @@
+# Per-job traces: span timings, token counts, cache hits and retries, exported as JSONL or Prometheus metrics
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+
+from chunker import count_tokens
+
+# Upper bounds in seconds of the span duration histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Upper bounds of the tokens per LLM call histogram buckets
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 128000)
+
+# Prefix of all exported metric names
+METRIC_PREFIX = "summarizer"
+
+# Help texts of the exported metrics
+METRIC_HELP = {
+    "jobs_total": "Pipeline jobs that were run",
+    "span_seconds": "Duration of pipeline stages, content loading steps and LLM calls",
+    "llm_calls_total": "LLM calls, split by whether the response cache answered them",
+    "llm_errors_total": "LLM calls that failed after all retries",
+    "llm_retries_total": "Retries of LLM calls after throttling or transient errors",
+    "llm_queue_seconds_total": "Seconds LLM calls waited for the requests/tokens per minute budget",
+    "llm_tokens_total": "Tokens sent to and generated by the model, cache hits excluded",
+    "llm_call_tokens": "Tokens per LLM call, cache hits excluded",
+    "prompt_part_tokens_total": "Prompt tokens of the generate stage spent on repeated instructions and on content",
+}
+
+# Trace and span that are open in the current thread
+_current = threading.local()
+
+
+@dataclass
+class Span:
+    name: str
+    # Seconds since the start of the trace
+    start: float
+    duration: float = 0.0
+    parent: str = None
+    attributes: dict = field(default_factory=dict)
+
+
+class Trace:
+    # Create an empty trace for one job
+    def __init__(self, job_id=None, **attributes):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.spans = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    # Record a span around a block of code, spans opened inside it in the same thread become its children
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = getattr(_current, "span", None)
+        previous_trace = getattr(_current, "trace", None)
+        started = time.perf_counter()
+        span = Span(name=name, start=round(started - self._started, 6), attributes=attributes,
+                    parent=parent.name if parent is not None and previous_trace is self else None)
+        _current.trace, _current.span = self, span
+        try:
+            yield span
+        except Exception as exc:
+            span.attributes["error"] = type(exc).__name__
+            raise
+        finally:
+            span.duration = round(time.perf_counter() - started, 6)
+            _current.trace, _current.span = previous_trace, parent
+            with self._lock:
+                self.spans.append(span)
+
+    # Add a span that was measured elsewhere, e.g. a stage whose work is spread over the whole job
+    def record(self, name, started, duration, **attributes):
+        span = Span(name=name, start=round(started - self._started, 6), duration=round(duration, 6),
+                    attributes=attributes)
+        with self._lock:
+            self.spans.append(span)
+
+    # Copy of the finished spans in the order they started
+    def finished_spans(self):
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span.start)
+
+    # Seconds from the start of the trace to the end of its last span
+    @property
+    def duration(self):
+        return max((span.start + span.duration for span in self.finished_spans()), default=0.0)
+
+    # Totals per span name: number of spans, seconds, tokens, cache hits and retries
+    def summary(self):
+        totals = defaultdict(lambda: defaultdict(float))
+        for span in self.finished_spans():
+            total = totals[span.name]
+            total["count"] += 1
+            total["seconds"] += span.duration
+            for name in ("prompt_tokens", "completion_tokens", "retries", "queue_seconds"):
+                total[name] += span.attributes.get(name, 0)
+            total["cache_hits"] += 1 if span.attributes.get("cache_hit") else 0
+            total["errors"] += 1 if "error" in span.attributes else 0
+        # Counters that stayed at zero are left out, e.g. tokens of the load stage
+        return {name: {key: value for key, value in total.items() if value or key in ("count", "seconds")}
+                for name, total in totals.items()}
+
+    # The trace as a JSON-serializable dict
+    def to_dict(self):
+        return {"job_id": self.job_id, "started_at": self.started_at, "duration": round(self.duration, 6),
+                "attributes": self.attributes, "spans": [asdict(span) for span in self.finished_spans()]}
+
+    # Rebuild a trace from to_dict, e.g. one that was recorded in a worker process
+    @classmethod
+    def from_dict(cls, data):
+        trace = cls(job_id=data["job_id"], **data["attributes"])
+        trace.started_at = data["started_at"]
+        trace.spans = [Span(**span) for span in data["spans"]]
+        return trace
+
+    # The trace as one JSON line
+    def to_jsonl(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False) + "\n"
+
+
+# Function to record a child span of the span open in this thread, or nothing if no trace is active
+@contextmanager
+def span(name, **attributes):
+    trace = getattr(_current, "trace", None)
+    if trace is None:
+        yield Span(name=name, start=0.0, attributes=attributes)
+        return
+    with trace.span(name, **attributes) as child:
+        yield child
+
+
+# Function to set attributes on the span open in this thread
+def annotate(**attributes):
+    current = getattr(_current, "span", None)
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+# Function to add to a counter attribute of the span open in this thread
+def increment(name, amount=1):
+    current = getattr(_current, "span", None)
+    if current is not None:
+        current.attributes[name] = current.attributes.get(name, 0) + amount
+
+
+# Function to append traces to a JSONL file
+def write_jsonl(traces, path):
+    with open(path, "a", encoding="utf-8") as trace_file:
+        for trace in traces:
+            trace_file.write(trace.to_jsonl())
+
+
+class TracedLLM:
+    # Wrap an LLM instance so every call is recorded as a span of the trace
+    def __init__(self, llm_instance, model_name, trace, stage=None):
+        self.llm_instance = llm_instance
+        self.model_name = model_name
+        self.trace = trace
+        self.stage = stage
+
+    # Same interface as the wrapped LLM instance
+    def generate_response(self, prompt, **kwargs):
+        with self.trace.span("llm_call", model=self.model_name, stage=self.stage, cache_hit=False) as call:
+            generated_text = self.llm_instance.generate_response(prompt=prompt, **kwargs)
+            # Exact counts reported by the API win over the local estimate
+            call.attributes.setdefault("prompt_tokens", count_tokens(prompt, self.model_name))
+            call.attributes.setdefault("completion_tokens", count_tokens(generated_text or "", self.model_name))
+            return generated_text
+
+
+class Metrics:
+    # Create empty Prometheus-style counters and histograms
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    # Add to a counter
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    # Add an observation to a histogram
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            histogram = self._histograms[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    # Add all spans of a finished trace
+    def record_trace(self, trace):
+        model = trace.attributes.get("model", "")
+        self.inc("jobs_total", {"model": model})
+        for span in trace.finished_spans():
+            self.observe("span_seconds", {"span": span.name}, span.duration)
+            if span.name == "generate":
+                for part in ("instruction", "content"):
+                    self.inc("prompt_part_tokens_total", {"model": model, "part": part},
+                             span.attributes.get(f"{part}_tokens", 0))
+            if span.name != "llm_call":
+                continue
+            labels = {"model": span.attributes.get("model", model)}
+            cache_hit = bool(span.attributes.get("cache_hit"))
+            self.inc("llm_calls_total", dict(labels, cache="hit" if cache_hit else "miss"))
+            if "error" in span.attributes:
+                self.inc("llm_errors_total", labels)
+            self.inc("llm_retries_total", labels, span.attributes.get("retries", 0))
+            self.inc("llm_queue_seconds_total", labels, span.attributes.get("queue_seconds", 0.0))
+            if cache_hit:
+                continue
+            # Cached answers cost no tokens, so they are left out of the token metrics
+            for kind in ("prompt", "completion"):
+                tokens = span.attributes.get(f"{kind}_tokens", 0)
+                self.inc("llm_tokens_total", dict(labels, type=kind), tokens)
+                self.observe("llm_call_tokens", dict(labels, type=kind), tokens, TOKEN_BUCKETS)
+
+    # The metrics in the Prometheus text exposition format
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(value, counts=list(value["counts"])) for key, value in self._histograms.items()}
+
+        lines = []
+        for name in METRIC_HELP:
+            full_name = f"{METRIC_PREFIX}_{name}"
+            counter_keys = sorted(key for key in counters if key[0] == name)
+            histogram_keys = sorted(key for key in histograms if key[0] == name)
+            if not counter_keys and not histogram_keys:
+                continue
+            lines.append(f"# HELP {full_name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {full_name} {'histogram' if histogram_keys else 'counter'}")
+            for key in counter_keys:
+                lines.append(f"{full_name}{_format_labels(key[1])} {counters[key]:g}")
+            for key in histogram_keys:
+                histogram = histograms[key]
+                for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                    lines.append(f"{full_name}_bucket{_format_labels(key[1] + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{full_name}_bucket{_format_labels(key[1] + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{full_name}_sum{_format_labels(key[1])} {histogram['sum']:g}")
+                lines.append(f"{full_name}_count{_format_labels(key[1])} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    # Write the metrics to a file, e.g. for the node exporter's textfile collector
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.render())
+
+
+# Function to format Prometheus labels
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+# Metrics of all jobs run in this process
+default_metrics = Metrics()
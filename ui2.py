@@ -1,7 +1,11 @@
 # Import necessary libraries
 import streamlit as st  # Streamlit for creating the web interface
-from SimplerLLM.language.llm import LLM, LLMProvider  # LLM and LLMProvider for language model handling
-from SimplerLLM.tools.generic_loader import load_content  # Function to load content from a URL
+from file_reader import SUPPORTED_FILE_TYPES, iter_file_text  # Incremental reading of uploaded files
+from pipeline import Job, ChunkingPolicy, run_job  # Shared pipeline engine
+
+# Model used for generation and its context window in tokens
+model_name = "gpt-3.5-turbo-1106"
+max_tokens = 16385
 
 # Set up the Streamlit app
 st.title("Blog-Post & YouTube Video Key Takeaways Extractor")  # Title of the web app
@@ -12,7 +16,7 @@ Enter the Blog-Post or Video URL, upload a file, and click the button to get the
 
 # Input for URL or file upload
 url = st.text_input("Enter URL", "")  # Text input for the URL
-uploaded_file = st.file_uploader("Or upload a file", type=["txt", "md"])  # File uploader for text files
+uploaded_file = st.file_uploader("Or upload a file", type=SUPPORTED_FILE_TYPES)  # File uploader for text, PDF and Word files
 
 # Default prompt template
 default_prompt = """
@@ -29,27 +33,19 @@ user_prompt = st.text_area("Edit the Prompt as needed", default_prompt)
 
 # Function to load content from file
 def load_file_content(file):
-    return file.read().decode("utf-8")
+    return iter_file_text(file, file.name)  # Decoded block by block while the chunks are generated
 
 # Button to generate key takeaways
 if st.button("Generate Key Takeaways"):
     if url or uploaded_file:  # Check if URL or file is provided
         with st.spinner("Loading content and generating summary..."):
-            if url:
-                # Load content from the provided URL
-                content = load_content(url).content
-            elif uploaded_file:
-                # Load content from the uploaded file
-                content = load_file_content(uploaded_file)
-
-            # Initialize the LLM instance with OpenAI provider and specific model
-            llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name="gpt-3.5-turbo-1106")
-
-            # Replace placeholder with actual content in the user-defined prompt
-            formatted_prompt = user_prompt.format(content=content)
-            
-            # Generate the summary using the LLM instance
-            generated_text = llm_instance.generate_response(prompt=formatted_prompt)
+            # The pipeline loads URLs itself, an uploaded file is read here
+            content = None if url else load_file_content(uploaded_file)
+
+            # Run the shared pipeline engine, long content is split into chunks that fit the model
+            job = Job(url=url, text=content, custom_prompt=user_prompt, model=model_name,
+                      chunking=ChunkingPolicy(context_tokens=max_tokens))
+            generated_text = run_job(job).output
             
             # Display the generated key takeaways
             st.subheader("Key Takeaways:")
@@ -1,16 +1,15 @@
 # Import necessary libraries
 import streamlit as st  # Streamlit for creating the web interface
-from SimplerLLM.language.llm import LLM, LLMProvider  # LLM and LLMProvider for language model handling
-from SimplerLLM.tools.generic_loader import load_content  # Function to load content from a URL
+from file_reader import SUPPORTED_FILE_TYPES, iter_file_text  # Incremental reading of uploaded files
+from pipeline import Job, ChunkingPolicy, run_job  # Shared pipeline engine
 
-# Function to split content into chunks
-def split_content(content, chunk_size=2000):
-    # Split the content into chunks of a specified size
-    return [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
+# Model used for generation and its context window in tokens
+model_name = "gpt-3.5-turbo-1106"
+max_tokens = 16385
 
 # Function to load content from file
 def load_file_content(file):
-    return file.read().decode("utf-8")
+    return iter_file_text(file, file.name)  # Decoded block by block while the chunks are generated
 
 # Set up the Streamlit app
 st.title("Blog-Post & YouTube Video Key Takeaways Extractor")  # Title of the web app
@@ -21,7 +20,7 @@ Enter the Blog-Post or Video URL, upload a file, and click the button to get the
 
 # Input for URL or file upload
 url = st.text_input("Enter URL", "")  # Text input for the URL
-uploaded_file = st.file_uploader("Or upload a file", type=["txt", "md"])  # File uploader for text files
+uploaded_file = st.file_uploader("Or upload a file", type=SUPPORTED_FILE_TYPES)  # File uploader for text, PDF and Word files
 
 # Default prompt template
 default_prompt = """I want you to only answer in German. 
@@ -47,35 +46,13 @@ user_prompt = st.text_area("Edit the Prompt as needed", default_prompt)
 if st.button("Generate Key Takeaways"):
     if url or uploaded_file:  # Check if URL or file is provided
         with st.spinner("Loading content and generating summary..."):
-            if url:
-                # Load content from the provided URL
-                content = load_content(url).content
-            elif uploaded_file:
-                # Load content from the uploaded file
-                content = load_file_content(uploaded_file)
+            # The pipeline loads URLs itself, an uploaded file is read here
+            content = None if url else load_file_content(uploaded_file)
 
-            # Split content into manageable chunks
-            chunks = split_content(content)
-
-            # Initialize the LLM instance with OpenAI provider and specific model
-            llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name="gpt-3.5-turbo-1106")
-
-            # Initialize an empty list to store results from each chunk
-            all_key_takeaways = []
-
-            # Process each chunk individually
-            for chunk in chunks:
-                # Replace placeholder with actual content in the user-defined prompt
-                formatted_prompt = user_prompt.format(content=chunk)
-                
-                # Generate the summary using the LLM instance
-                generated_text = llm_instance.generate_response(prompt=formatted_prompt)
-                
-                # Append the result to the list of all key takeaways
-                all_key_takeaways.append(generated_text)
-            
-            # Combine all key takeaways into a single string
-            combined_key_takeaways = "\n".join(all_key_takeaways)
+            # Run the shared pipeline engine: split, generate concurrently and join
+            job = Job(url=url, text=content, custom_prompt=user_prompt, model=model_name,
+                      chunking=ChunkingPolicy(context_tokens=max_tokens))
+            combined_key_takeaways = run_job(job).output
             
             # Display the generated key takeaways
             st.subheader("Key Takeaways:")
@@ -1,20 +1,16 @@
 # Import necessary libraries
 import streamlit as st  # Streamlit for creating the web interface
-from SimplerLLM.language.llm import LLM, LLMProvider  # LLM and LLMProvider for language model handling
-from SimplerLLM.tools.generic_loader import load_content  # Function to load content from a URL
-
-# Function to split content into chunks
-def split_content(content, chunk_size):
-    # Split the content into chunks of a specified size
-    return [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
+from file_reader import SUPPORTED_FILE_TYPES, iter_file_text  # Incremental reading of uploaded files
+from content_loader import default_loader  # Shared content cache, used to measure a URL before planning
+from models import AUTO_MODEL, model_catalog  # Catalog of the selectable models
+from model_router import count_content_tokens, plan_models  # Plans of the Auto model option
+from parallel_generation import DEFAULT_MAX_WORKERS  # Default number of parallel chunk requests
+from pipeline import Job, run_job  # Shared pipeline engine
 
 # Function to load content from file
 def load_file_content(file):
-    return file.read().decode("utf-8")
-
-# Function to calculate chunk size based on model
-def calculate_chunk_size(max_tokens, prompt_tokens=1000):
-    return max_tokens - prompt_tokens
+    file.seek(0)  # The file may have been read before to measure it
+    return iter_file_text(file, file.name)  # Decoded block by block while the chunks are generated
 
 # Set up the Streamlit app
 st.title("Blog-Post & YouTube Video Key Takeaways Extractor")  # Title of the web app
@@ -25,23 +21,13 @@ Enter the Blog-Post or Video URL, upload a file, and click the button to get the
 
 # Input for URL or file upload
 url = st.text_input("Enter URL", "")  # Text input for the URL
-uploaded_file = st.file_uploader("Or upload a file", type=["txt", "md"])  # File uploader for text files
+uploaded_file = st.file_uploader("Or upload a file", type=SUPPORTED_FILE_TYPES)  # File uploader for text, PDF and Word files
 
 # Model selection
-model_option = st.selectbox("Choose a GPT model", ["gpt-3.5-turbo", "gpt-4 (8k context)", "gpt-4 (32k context)"])
-
-# Define maximum tokens based on selected model
-model_token_limits = {
-    "gpt-3.5-turbo": 4096,
-    "gpt-4 (8k context)": 8192,
-    "gpt-4 (32k context)": 32768
-}
-
-# Get the maximum token limit for the selected model
-max_tokens = model_token_limits[model_option]
+model_option = st.selectbox("Choose a GPT model", list(model_catalog) + [AUTO_MODEL])
 
-# Calculate recommended chunk size
-chunk_size = calculate_chunk_size(max_tokens)
+# Number of chunks that are sent to the model at the same time
+max_workers = st.slider("Max parallel requests", min_value=1, max_value=16, value=DEFAULT_MAX_WORKERS)
 
 # API Key input
 api_key = st.text_input("Enter your OpenAI API key", type="password")
@@ -86,38 +72,24 @@ else:
 if st.button("Generate Output"):
     if (url or uploaded_file) and api_key:  # Check if URL or file is provided and API key is entered
         with st.spinner("Loading content and generating summary..."):
-            if url:
-                # Load content from the provided URL
-                content = load_content(url).content
-            elif uploaded_file:
-                # Load content from the uploaded file
-                content = load_file_content(uploaded_file)
-
-            # Split content into manageable chunks
-            chunks = split_content(content, chunk_size)
-
-            # Set the API key for the LLM instance
-            LLM.api_key = api_key
-
-            # Initialize the LLM instance with OpenAI provider and specific model
-            llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name=model_option)
-
-            # Initialize an empty list to store results from each chunk
-            all_key_takeaways = []
-
-            # Process each chunk individually
-            for chunk in chunks:
-                # Replace placeholder with actual content in the user-defined prompt
-                formatted_prompt = user_prompt.format(content=chunk)
-                
-                # Generate the summary using the LLM instance
-                generated_text = llm_instance.generate_response(prompt=formatted_prompt)
-                
-                # Append the result to the list of all key takeaways
-                all_key_takeaways.append(generated_text)
-            
-            # Combine all key takeaways into a single string
-            combined_key_takeaways = "\n".join(all_key_takeaways)
+            # Describe the job for the shared pipeline engine
+            job = Job(url=url, custom_prompt=user_prompt, model=model_option, api_key=api_key,
+                      max_workers=max_workers)
+
+            # With Auto the content is measured first and the model with the best plan is used
+            if model_option == AUTO_MODEL:
+                content_tokens = count_content_tokens(default_loader.load(url) if url
+                                                      else load_file_content(uploaded_file), AUTO_MODEL)
+                best = plan_models(job, content_tokens)[0]
+                job.model = best.model
+                st.info(f"{content_tokens} content tokens: using {best.model} with {best.calls} call(s), "
+                        f"about {best.seconds:.0f} s and ${best.cost:.4f}.")
+
+            # The pipeline loads URLs itself, an uploaded file is read here
+            job.text = None if url else load_file_content(uploaded_file)
+
+            # Run the shared pipeline engine: split, generate concurrently and join
+            combined_key_takeaways = run_job(job).output
             
             # Display the generated key takeaways
             st.subheader("Output:")
@@ -1,20 +1,82 @@
 # Import necessary libraries
+import time  # Time for polling running jobs
+from dataclasses import asdict  # Plans as table rows
 import streamlit as st  # Streamlit for creating the web interface
-from SimplerLLM.language.llm import LLM, LLMProvider  # LLM and LLMProvider for language model handling
-from SimplerLLM.tools.generic_loader import load_content  # Function to load content from a URL
-
-# Function to split content into chunks
-def split_content(content, chunk_size):
-    # Split the content into chunks of a specified size
-    return [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
+from content_loader import default_loader  # Shared content cache, used to measure a URL before planning
+from file_reader import SUPPORTED_FILE_TYPES, iter_file_text  # Incremental reading of uploaded files
+from models import AUTO_MODEL, model_catalog  # Catalog of the selectable models
+from model_router import count_content_tokens, plan_models  # Plans of the Auto model option
+from parallel_generation import DEFAULT_MAX_WORKERS  # Default number of parallel chunk requests
+from prompts import default_prompts, build_prompt  # Prompt presets
+from pipeline import Job, ChunkingPolicy, plan_job_reduce_depth  # Shared pipeline engine
+from job_queue import get_default_queue, JOB_BROKER_PATH, QUEUED, RUNNING, DONE, FAILED  # Background jobs that survive reruns
+from tracing import default_metrics  # Prometheus-style metrics of all jobs in this process
+
+# Queue that jobs are submitted to, in this process or in separate worker processes
+default_queue = get_default_queue()
 
 # Function to load content from file
 def load_file_content(file):
-    return file.read().decode("utf-8")
-
-# Function to calculate chunk size based on model
-def calculate_chunk_size(max_tokens, prompt_tokens=1000):
-    return max_tokens - prompt_tokens
+    file.seek(0)  # The file may have been read before to measure it
+    return iter_file_text(file, file.name)  # Decoded block by block while the chunks are generated
+
+# Function to start a job in the background
+def submit_job(job):
+    # Its id in the session and in the URL lets the page reattach after a rerun or a reload of the browser tab
+    st.session_state["job_id"] = default_queue.submit(job)
+    st.query_params["job"] = st.session_state["job_id"]
+
+# Function to cancel the job of this session
+def cancel_job(record):
+    if not default_queue.cancel(record.id):
+        # Other sessions still wait for the same job, so this session only stops following it
+        st.session_state.pop("job_id", None)
+        st.query_params.clear()
+
+# Function to show the progress and the partial outputs of a job that is still running
+def show_progress(record, state):
+    job = record.job
+    if state["status"] == QUEUED:
+        st.info(f"Waiting for a free worker, {default_queue.position(record.id)} job(s) ahead.")
+        return
+    if not state["labels"] and state["num_chunks"] is None:
+        st.info(f"Running: {state['stage'] or 'starting'}...")
+        return
+    # The number of chunks is known once all content is split and sent
+    if job.chunking.merge_outputs and (state["num_chunks"] or 0) > 1 and not job.chunking.shared_summary:
+        # Show how many merge levels the selected model needs for this content
+        reduce_depth = plan_job_reduce_depth(job, state["num_chunks"])
+        st.caption(f"Merging {state['num_chunks']} chunk outputs in about {reduce_depth} reduce level(s).")
+    if state["labels"]:
+        st.progress(state["calls_done"] / len(state["labels"]),
+                    text=f"{state['calls_done']}/{len(state['labels'])} calls done ({state['stage']})")
+    # Outputs are shown as soon as they finish, or token by token when streaming
+    st.subheader("Output:")
+    for label, text in zip(state["labels"], state["outputs"]):
+        if text:
+            st.markdown(f"**{label}**")
+            st.markdown(text)
+
+# Function to show where the time and tokens of a job went
+def show_debug_panel(trace):
+    with st.expander("Debug: stage timings and token usage", expanded=True):
+        st.caption(f"Job {trace.job_id}, {trace.duration:.2f} s in total")
+        # Share of the prompt tokens that repeat the instructions instead of carrying content
+        generate = next((span for span in trace.finished_spans() if span.name == "generate"), None)
+        if generate is not None and "instruction_ratio" in generate.attributes:
+            st.caption(f"{generate.attributes['instruction_tokens']} instruction tokens for "
+                       f"{generate.attributes['content_tokens']} content tokens "
+                       f"(ratio {generate.attributes['instruction_ratio']:.2f})")
+        # One row per span name: how often it ran, how long it took and what it cost
+        summary = [dict(span=name, **{key: round(value, 3) for key, value in total.items()})
+                   for name, total in trace.summary().items()]
+        st.dataframe(summary, use_container_width=True)
+        # Every single span, e.g. to spot one slow chunk
+        spans = [dict(name=span.name, parent=span.parent, start=span.start, duration=span.duration, **span.attributes)
+                 for span in trace.finished_spans()]
+        st.dataframe(spans, use_container_width=True)
+        st.download_button("Download trace (JSONL)", trace.to_jsonl(), file_name=f"trace-{trace.job_id}.jsonl")
+        st.download_button("Download metrics (Prometheus)", default_metrics.render(), file_name="metrics.prom")
 
 # Set up the Streamlit app
 st.title("Blog-Post & YouTube Video Key Takeaways Extractor")  # Title of the web app
@@ -23,8 +85,18 @@ This app extracts key takeaways from a Blog-Post or a YouTube video using an LLM
 Enter the Blog-Post or Video URL, upload a file, and click the button to get the key takeaways in German.
 """)  # Description of the app
 
-# API Key input
-api_key = st.text_input("Enter your OpenAI API key", type="password")
+# Sidebar option to skip cached responses and always ask the model again
+bypass_cache = st.sidebar.checkbox("Bypass response cache", value=False)
+
+# Sidebar option to show the timings and token counts of every stage after a run
+show_debug = st.sidebar.checkbox("Show debug panel", value=False)
+
+# API Key input, the worker processes of the multi-worker mode use their own key
+if JOB_BROKER_PATH:
+    api_key = None
+    st.caption("Jobs run on the shared workers with the server's OpenAI API key.")
+else:
+    api_key = st.text_input("Enter your OpenAI API key", type="password")
 
 # Language selection
 language_option = st.selectbox("Select language", ["German", "English", "French", "Spanish", "Italian", "Custom"])
@@ -37,107 +109,138 @@ else:
 
 # Input for URL or file upload
 url = st.text_input("Enter URL", "")  # Text input for the URL
-uploaded_file = st.file_uploader("Or upload a file", type=["txt", "md"])  # File uploader for text files
+uploaded_file = st.file_uploader("Or upload a file", type=SUPPORTED_FILE_TYPES)  # File uploader for text, PDF and Word files
 
 # Model selection
-model_option = st.selectbox("Choose a GPT model", ["gpt-3.5-turbo", "gpt-4 (8k context)", "gpt-4 (32k context)"])
-
-# Define maximum tokens based on selected model
-model_token_limits = {
-    "gpt-3.5-turbo": 4096,
-    "gpt-4 (8k context)": 8192,
-    "gpt-4 (32k context)": 32768
-}
-
-# Get the maximum token limit for the selected model
-max_tokens = model_token_limits[model_option]
-
-# Calculate recommended chunk size
-chunk_size = calculate_chunk_size(max_tokens)
-
-# Default prompts
-default_prompts = {
-    "Instagram Post": """
-    Act as if you're a social media expert.
-    I want you to create 5 different Instagram posts in {language} based on the Content. 
-    The thread should be optimized for virality and contain 
-    relevant hashtags and a catchy caption. Stop when you created exactly 5 Posts.
-    Content: {content}""",
-
-    "Tweet Post": """
-    Act as if you're a social media expert. 
-    Give me a 10 tweet thread based on the following Content: {content}. 
-    The thread should be optimized for virality and contain 
-    hashtags and emoticons. Each tweet should not exceed 280 characters in length.""",
-
-    "Student Notes": """
-    I want you to create summary notes in {language} based on the Content. 
-    Summarize the key points as if you were taking notes to learn from the content.
-    Content: {content}"""
-}
-
-# Prompt selection
-prompt_option = st.selectbox("Select task", ["Instagram Post", "Tweet Post", "Student Notes", "Custom Prompt"])
-
-if prompt_option == "Custom Prompt":
-    custom_prompt = st.text_area("Enter your custom prompt", "")
-    prompt = custom_prompt if custom_prompt else default_prompts["Instagram Post"]
-else:
-    prompt = default_prompts[prompt_option]
+model_option = st.selectbox("Choose a GPT model", list(model_catalog) + [AUTO_MODEL])
 
-# Replace language placeholder in prompt
-prompt = prompt.replace("{language}", language)
+# Number of chunks that are sent to the model at the same time
+max_workers = st.slider("Max parallel requests", min_value=1, max_value=16, value=DEFAULT_MAX_WORKERS)
+
+# Task selection, all selected tasks are generated from one load of the content
+task_options = st.multiselect("Select tasks", list(default_prompts) + ["Custom Prompt"], default=["Instagram Post"])
+presets = [task for task in task_options if task != "Custom Prompt"]
 
 # Custom prompt input if selected
-if prompt_option == "Custom Prompt":
-    user_prompt = st.text_area("Enter your custom prompt", key="user_custom_prompt")
-else:
-    user_prompt = prompt
+user_prompt = None
+if "Custom Prompt" in task_options:
+    custom_prompt = st.text_area("Enter your custom prompt", key="user_custom_prompt")
+    if custom_prompt:
+        # Replace language placeholder in prompt, content the prompt does not mention is added at the end
+        user_prompt = build_prompt(custom_prompt, language)
+        if "{content}" not in user_prompt:
+            user_prompt += "\nContent: {content}"
+
+# Option to condense long content once and create every selected output from the condensed notes
+shared_summary = False
+if len(presets) + bool(user_prompt) > 1:
+    shared_summary = st.checkbox("Condense the content once and create all outputs from it (fewer calls)",
+                                 value=False)
+
+# Option to merge the outputs of all chunks into one result instead of listing them one after another
+merge_outputs = st.checkbox("Merge chunk outputs into a single result (map-reduce)", value=False)
+
+# Option to clean noisy pages and transcripts and to skip chunks that repeat earlier ones
+remove_noise = st.checkbox("Remove boilerplate and duplicate chunks", value=True)
+
+# Option to show every chunk's response while it is being generated
+stream_output = st.checkbox("Stream output as it is generated", value=True)
+
+# Seconds between two looks at a running job
+POLL_SECONDS = 0.5 if stream_output else 1.0
 
 # Button to generate key takeaways
 if st.button("Generate Output"):
-    if (url or uploaded_file) and api_key:  # Check if URL or file is provided and API key is entered
-        with st.spinner("Loading content and generating summary..."):
-            if url:
-                # Load content from the provided URL
-                content = load_content(url).content
-            elif uploaded_file:
-                # Load content from the uploaded file
-                content = load_file_content(uploaded_file)
-
-            # Split content into manageable chunks
-            chunks = split_content(content, chunk_size)
-
-            # Set the API key for the LLM instance
-            LLM.api_key = api_key
-
-            # Initialize the LLM instance with OpenAI provider and specific model
-            llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name=model_option)
-
-            # Initialize an empty list to store results from each chunk
-            all_key_takeaways = []
-
-            # Process each chunk individually
-            for chunk in chunks:
-                # Replace placeholder with actual content in the user-defined prompt
-                formatted_prompt = user_prompt.format(content=chunk)
-                
-                # Generate the summary using the LLM instance
-                generated_text = llm_instance.generate_response(prompt=formatted_prompt)
-                
-                # Append the result to the list of all key takeaways
-                all_key_takeaways.append(generated_text)
-            
-            # Combine all key takeaways into a single string
-            combined_key_takeaways = "\n".join(all_key_takeaways)
-            
-            # Display the generated key takeaways
-            st.subheader("Output:")
-            st.write(combined_key_takeaways)
-            
-            # Add a copy button for the output
-            st.button("Copy to Clipboard", on_click=lambda: st.write(st.code(combined_key_takeaways, language='markdown')))
-            # Option to download the output as a file
-            st.download_button("Download as TXT", combined_key_takeaways, file_name="output.txt")
+    if not presets and not user_prompt:
+        st.error("Please select at least one task or enter a custom prompt.")
+    elif (url or uploaded_file) and (api_key or JOB_BROKER_PATH):  # Check if URL or file is provided and API key is entered
+        # Describe the job for the shared pipeline engine
+        job = Job(url=url, presets=presets, custom_prompt=user_prompt, model=model_option,
+                  api_key=api_key, max_workers=max_workers, stream=stream_output, bypass_cache=bypass_cache,
+                  chunking=ChunkingPolicy(merge_outputs=merge_outputs, strip_boilerplate=remove_noise,
+                                          drop_duplicates=remove_noise, shared_summary=shared_summary))
+        st.session_state.pop("plan", None)
+
+        if model_option == AUTO_MODEL:
+            # Measure the content and plan the job on every model, it only starts once the plan is confirmed
+            with st.spinner("Measuring the content..."):
+                try:
+                    content = default_loader.load(url) if url else load_file_content(uploaded_file)
+                    content_tokens = count_content_tokens(content, AUTO_MODEL)
+                    st.session_state["plan"] = {"job": job, "content_tokens": content_tokens,
+                                                "plans": plan_models(job, content_tokens)}
+                except Exception as exc:
+                    st.error(f"Loading the content failed: {exc}")
+        else:
+            # The pipeline loads URLs itself, an uploaded file is read here
+            job.text = None if url else load_file_content(uploaded_file)
+            submit_job(job)
     else:
         st.error("Please enter a valid URL or upload a file and provide your OpenAI API key.")  # Display an error if neither URL nor file is provided and API key is not entered
+
+# Show the plan of an Auto job, the best model is preselected but can be changed before the job starts
+plan = st.session_state.get("plan")
+if plan is not None:
+    best = plan["plans"][0]
+    st.subheader("Plan:")
+    st.info(f"{plan['content_tokens']} content tokens: {best.model} needs {best.calls} call(s), "
+            f"about {best.seconds:.0f} s and ${best.cost:.4f}.")
+    st.dataframe([dict(asdict(model_plan), cost=round(model_plan.cost, 4), seconds=round(model_plan.seconds, 1))
+                  for model_plan in plan["plans"]], use_container_width=True)
+    chosen_model = st.selectbox("Model to run", [model_plan.model for model_plan in plan["plans"]])
+    if st.button(f"Run with {chosen_model}", key="run-plan"):
+        job = plan["job"]
+        if job.url or uploaded_file:
+            job.model = chosen_model
+            job.text = None if job.url else load_file_content(uploaded_file)
+            st.session_state.pop("plan")
+            submit_job(job)
+            st.rerun()
+        else:
+            st.error("Please upload the file again.")
+
+# Show the job of this session, or the one named in the URL after a reload
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+record = default_queue.get(job_id) if job_id else None
+
+if record is not None:
+    st.session_state["job_id"] = record.id
+    state = record.snapshot()
+
+    if state["status"] in (QUEUED, RUNNING):
+        show_progress(record, state)
+        # Stop the job, chunks that are already sent still finish
+        st.button("Cancel", on_click=cancel_job, args=(record,))
+        time.sleep(POLL_SECONDS)
+        st.rerun()
+    elif state["status"] == DONE:
+        result = state["result"]
+
+        # Display the generated outputs, one tab per task
+        st.subheader("Output:")
+        if result.trace.attributes.get("result_store"):
+            st.caption("This output was already generated for the same request and is served from the shared store.")
+        if result.duplicate_chunks:
+            st.caption(f"Skipped {result.duplicate_chunks} chunk(s) that repeated earlier content.")
+        for tab, (task, output) in zip(st.tabs(list(result.outputs)), result.outputs.items()):
+            with tab:
+                st.markdown(output)
+                # Add a copy button for the output
+                st.button("Copy to Clipboard", key=f"copy-{task}",
+                          on_click=lambda output=output: st.write(st.code(output, language='markdown')))
+                # Option to download the output as a file
+                file_name = task.lower().replace(" ", "-") + ".txt"
+                st.download_button("Download as TXT", output, file_name=file_name, key=f"download-{task}")
+
+        if show_debug:
+            show_debug_panel(result.trace)
+    elif state["status"] == FAILED:
+        st.error(f"Generating the output failed: {state['error']}")
+        if show_debug:
+            show_debug_panel(record.trace)
+    else:
+        st.warning("The job was cancelled.")
+elif job_id:
+    # Finished jobs are only kept for a while
+    st.session_state.pop("job_id", None)
+    st.query_params.clear()
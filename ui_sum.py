@@ -1,7 +1,10 @@
 # Import necessary libraries
 import streamlit as st  # Streamlit for creating the web interface
-from SimplerLLM.language.llm import LLM, LLMProvider  # LLM and LLMProvider for language model handling
-from SimplerLLM.tools.generic_loader import load_content  # Function to load content from a URL
+from pipeline import Job, ChunkingPolicy, run_job  # Shared pipeline engine
+
+# Model used for generation and its context window in tokens
+model_name = "gpt-3.5-turbo-1106"
+max_tokens = 16385
 
 # Set up the Streamlit app
 st.title("Blog-Post & YouTube Video Key Takeaways Extractor")  # Title of the web app
@@ -18,14 +21,8 @@ if st.button("Generate Key Takeaways"):
     if url:  # Check if the URL is provided
         # Display a loading message while processing
         with st.spinner("Loading content and generating summary..."):
-            # Load content from the provided URL
-            content = load_content(url).content
-            
-            # Initialize the LLM instance with OpenAI provider and specific model
-            llm_instance = LLM.create(provider=LLMProvider.OPENAI, model_name="gpt-3.5-turbo-1106")
-            
-            # Create the prompt for generating the summary
-            youtube_to_points_summary = f"""
+            # Create the prompt template for generating the summary
+            youtube_to_points_summary = """
             I want you to only answer in German. 
             Please extract key takeaways of the Content. 
             Each key takeaway should be a list item, of the following format:
@@ -34,8 +31,10 @@ if st.button("Generate Key Takeaways"):
             Please try to use different emojis for each takeaway. Do not render brackets.
             Content: {content}"""
             
-            # Generate the summary using the LLM instance
-            generated_text = llm_instance.generate_response(prompt=youtube_to_points_summary)
+            # Load the content and generate the summary with the shared pipeline engine
+            job = Job(url=url, custom_prompt=youtube_to_points_summary, model=model_name,
+                      chunking=ChunkingPolicy(context_tokens=max_tokens))
+            generated_text = run_job(job).output
             
             # Display the generated key takeaways
             st.subheader("Key Takeaways:")